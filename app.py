@@ -1,11 +1,35 @@
+import asyncio
 import json
 from fastapi import FastAPI, Depends
 
-from config.config import initiate_database
+from commons.metrics import get_metrics
+from commons.middleware import BodySizeLimitMiddleware
+from config.config import get_settings, initiate_database, install_reload_signal
 from routes.messages import router as MessagesRouter
-from routes.chatpdf import router as ChatPDFRouter
+from routes.chatpdf import (
+    FILE_TOO_LARGE,
+    MAX_UPLOAD_REQUEST_BYTES,
+    UPLOAD_PATHS,
+    router as ChatPDFRouter,
+)
+from services.analysis import shutdown_analysis_pool
+from services.inference import summarize_batcher
+from services.ingestion import ingest_queue
+from services.messagesink import message_sink
+from services.modelrouter import model_router
+from services.pdfextract import shutdown_pdf_pool
+from services.quota import quota_flusher
+from services.textmodels import model_registry
+from vendor.openrouter import start_upstream_client, stop_upstream_client
 
 app = FastAPI()
+# uploads are cut off while received, before starlette spools them to disk
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_REQUEST_BYTES,
+    paths=UPLOAD_PATHS,
+    detail=FILE_TOO_LARGE,
+)
 
 
 @app.on_event("startup")
@@ -13,11 +37,79 @@ async def start_database():
     await initiate_database()
 
 
+@app.on_event("startup")
+async def start_upstream():
+    await start_upstream_client(get_settings())
+
+
+@app.on_event("shutdown")
+async def stop_upstream():
+    await stop_upstream_client()
+
+
+@app.on_event("startup")
+async def watch_settings_reload():
+    install_reload_signal(asyncio.get_running_loop())
+
+
+@app.on_event("startup")
+async def start_quota_flusher():
+    quota_flusher.start()
+
+
+@app.on_event("shutdown")
+async def stop_quota_flusher():
+    await quota_flusher.stop()
+
+
+@app.on_event("startup")
+async def start_message_sink():
+    message_sink.start()
+
+
+@app.on_event("shutdown")
+async def stop_message_sink():
+    await message_sink.stop()
+
+
+@app.on_event("startup")
+async def warm_text_models():
+    # load middle-out tokenizer (and summarizer) once before serving requests
+    settings = get_settings()
+    model_registry.warm(
+        settings.TEXT_HANDLE_MODEL, settings.TEXT_HANDLE_WARM_SUMMARIZER
+    )
+    summarize_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_inference():
+    # waits for the running batch, the join must not block the event loop
+    await asyncio.to_thread(summarize_batcher.stop)
+    shutdown_analysis_pool()
+
+
+@app.on_event("startup")
+async def start_ingest_queue():
+    ingest_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_queue.stop()
+    shutdown_pdf_pool()
+
+
 @app.get("/", tags=["Root"], summary="ping server")
 async def ping():
     return {"message": "Hello world"}
 
 
+@app.get("/metrics", tags=["Root"], summary="cache and chat model metrics")
+async def metrics():
+    return {**get_metrics(), "chat_models": model_router.snapshot()}
+
+
 app.include_router(MessagesRouter, tags=["聊天"])
 
 app.include_router(ChatPDFRouter, tags=["ChatPDF"])
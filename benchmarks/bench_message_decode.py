@@ -0,0 +1,61 @@
+"""
+Per-row decode cost of the Beanie document read path vs. the projection rows
+
+    python -m benchmarks.bench_message_decode --rows 10000
+"""
+import argparse
+import time
+
+from bson import ObjectId
+
+from database.messagesdb import MessageRow
+from models.messages import Messages
+
+
+def make_raw_rows(n: int):
+    return [
+        {
+            "_id": ObjectId(),
+            "user_name": "meng",
+            "type": "user" if i % 2 else "ai",
+            "text": f"Hi, my name is Meng, message {i} " * 4,
+            "ctime": 1706275357000 + i,
+            "mtime": 1706275357000 + i,
+        }
+        for i in range(n)
+    ]
+
+
+def bench(name: str, decode, rows, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(rows)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<22} {best * 1e6 / len(rows):8.2f} us/row")
+
+
+def decode_documents(rows):
+    # what find().to_list() does for every row
+    return [Messages.model_validate(row) for row in rows]
+
+
+def decode_rows(rows):
+    # the projection only returns these fields from mongo
+    return [MessageRow(row["type"], row["text"], row["ctime"]) for row in rows]
+
+
+def decode_dicts(rows):
+    return [{"text": row["text"], "ctime": row["ctime"]} for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_raw_rows(args.rows)
+    bench("beanie documents", decode_documents, rows, args.repeat)
+    bench("MessageRow (__slots__)", decode_rows, rows, args.repeat)
+    bench("raw dicts", decode_dicts, rows, args.repeat)
@@ -0,0 +1,59 @@
+"""
+Sliding window rate limiter benchmark, needs the redis configured in vendor/redis.py
+
+    python -m benchmarks.bench_rate_limit --users 10 --requests 300 --limit 3
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from vendor.redis import aredis_conn, can_pass_slide_window
+
+
+async def timed_check(key: str, time_period: int, limit_count: int):
+    start = time.perf_counter()
+    can_pass = await can_pass_slide_window(key, time_period, limit_count)
+    return can_pass, (time.perf_counter() - start) * 1000
+
+
+async def run(users: int, requests: int, time_period: int, limit_count: int):
+    keys = [f"bench:message-limit:user-{i}" for i in range(users)]
+    await aredis_conn.delete(*keys)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[
+            timed_check(key, time_period, limit_count)
+            for key in keys
+            for _ in range(requests)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    await aredis_conn.delete(*keys)
+
+    latencies = sorted(latency for _, latency in results)
+    passed = [
+        sum(1 for can_pass, _ in results[i * requests : (i + 1) * requests] if can_pass)
+        for i in range(users)
+    ]
+    print(f"checks: {len(results)}, elapsed: {elapsed:.3f}s")
+    print(f"throughput: {len(results) / elapsed:.0f} checks/s")
+    print(
+        f"latency ms: p50 {statistics.median(latencies):.2f}, "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f}, "
+        f"max {latencies[-1]:.2f}"
+    )
+    print(f"passed per user: {passed}")
+    # every user must get exactly limit_count requests through
+    assert all(cnt == min(limit_count, requests) for cnt in passed), passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--time-period", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.requests, args.time_period, args.limit))
@@ -3,3 +3,4 @@ HTTP_STATUS_CODE_400_BAD_REQUEST = 400
 HTTP_STATUS_CODE_401_UNAUTHORIZED = 401
 HTTP_STATUS_CODE_500_SERVER_ERROR = 500
 HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE = 503
+ANALYSIS_TIMEZONE = "Asia/Shanghai"
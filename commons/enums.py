@@ -5,3 +5,17 @@ class MIDDLE_OUT_MODE(str, Enum):
     SUMMARITION = "summarition"
     TRIM = "trim"
     IGNORE = "ignore"
+
+
+class MESSAGE_WRITE_MODE(str, Enum):
+    # wait for the batched insert to be acknowledged before responding
+    ACK = "ack"
+    # respond right away, messages are written by the background flush
+    ASYNC = "async"
+
+
+class INGEST_JOB_STATUS(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
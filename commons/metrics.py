@@ -0,0 +1,41 @@
+import threading
+from typing import Dict
+
+
+class HitMissCounter:
+    """
+    hit / miss counter of a cache, shown by the /metrics endpoint
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self, n: int = 1):
+        with self._lock:
+            self.hits += n
+
+    def miss(self, n: int = 1):
+        with self._lock:
+            self.misses += n
+
+    def snapshot(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
+
+_counters: Dict[str, HitMissCounter] = {}
+
+
+def get_hit_miss_counter(name: str) -> HitMissCounter:
+    return _counters.setdefault(name, HitMissCounter(name))
+
+
+def get_metrics() -> Dict:
+    return {name: counter.snapshot() for name, counter in _counters.items()}
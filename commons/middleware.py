@@ -0,0 +1,74 @@
+from typing import Iterable
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from commons.costants import HTTP_STATUS_CODE_400_BAD_REQUEST
+
+
+class RequestBodyTooLarge(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=HTTP_STATUS_CODE_400_BAD_REQUEST, detail=detail)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects request bodies over `max_bytes` on the given paths while they are
+    received, before the multipart parser spools them to disk. Covers chunked
+    uploads and clients sending a wrong content-length alike.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int, paths: Iterable[str], detail: str):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+        self.detail = detail
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        try:
+            declared = int(content_length) if content_length is not None else None
+        except ValueError:
+            await self._reject(scope, receive, send, "invalid content-length header")
+            return
+        if declared is not None and declared > self.max_bytes:
+            await self._reject(scope, receive, send, self.detail)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # fastapi re-raises HTTPException from body parsing as is
+                    raise RequestBodyTooLarge(self.detail)
+            return message
+
+        response_started = False
+
+        async def tracking_send(message: Message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestBodyTooLarge as e:
+            if response_started:
+                raise
+            await self._reject(scope, receive, send, e.detail)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, detail: str):
+        response = JSONResponse(
+            {"detail": detail}, status_code=HTTP_STATUS_CODE_400_BAD_REQUEST
+        )
+        await response(scope, receive, send)
@@ -1,6 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 
 
-def get_current_date_str(now: int = datetime.now()):
+def get_current_date_str(now: Optional[datetime] = None):
+    now = now or datetime.now()
     formatted_date = now.strftime("%Y-%m-%d")
     return formatted_date
+
+
+def get_next_midnight_ts(now: Optional[datetime] = None) -> int:
+    """
+    unix timestamp (seconds) of the next local midnight
+    """
+    now = now or datetime.now()
+    midnight = (now + timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return int(midnight.timestamp())
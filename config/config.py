@@ -1,37 +1,199 @@
-from typing import Optional
+import signal
+import threading
+from typing import Callable, List, Optional
 
 from beanie import init_beanie
+from loguru import logger
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 import models as models
+from database.userlimitsdb import merge_duplicate_userlimits
+from models.userlimits import UserLimits
 
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env.dev", frozen=True)
+
     # database configurations
     DATABASE_URL: Optional[str] = None
 
-    CHAT_REQUEST_TIME_OUT: Optional[str] = 0
+    CHAT_REQUEST_TIME_OUT: float = 0
     OPENROUTER_API_URL: Optional[str] = None
 
     CHAT_MODEL: Optional[str] = None
     TEXT_HANDLE_MODEL: Optional[str] = None
-    TEXT_HANDLE_MAX_TOKENS: Optional[str] = None
+    TEXT_HANDLE_MAX_TOKENS: Optional[int] = None
+    # tokenizer/model registry, 0 means no limit for memory budget
+    TEXT_HANDLE_MODEL_CACHE_SIZE: int = 4
+    TEXT_HANDLE_MODEL_CACHE_MB: int = 0
+    TEXT_HANDLE_WARM_SUMMARIZER: bool = False
+    # micro-batching for summarition middle-out mode
+    SUMMARIZE_BATCH_SIZE: int = 8
+    SUMMARIZE_BATCH_WAIT_MS: int = 20
 
     DEFAULT_PROMPT: Optional[str] = None
     DEFAULT_ADVANCED_PROMPT: Optional[str] = None
 
-    CHAT_LIMIT_ONE_DAY_COUNT: Optional[str] = 0
-    CHAT_LIMIT_RATE_TIME_PERIOD: Optional[str] = 0
-    CHAT_LIMIT_RATE_COUNT: Optional[str] = 0
+    CHAT_LIMIT_ONE_DAY_COUNT: int = 0
+    CHAT_LIMIT_RATE_TIME_PERIOD: int = 0
+    CHAT_LIMIT_RATE_COUNT: int = 0
+    # seconds between write-behind flushes of daily chat counts to mongo
+    CHAT_LIMIT_FLUSH_INTERVAL: float = 5
     OPENROUTER_API_KEY: Optional[str] = None
+    # exact-match chat answer cache per endpoint, 0 ttl disables it
+    CHAT_RESPONSE_CACHE_TTL: int = 0
+    CHAT_RESPONSE_CACHE_ADVANCED: bool = False
+    # ordered "model[:weight]" list for routing, empty means only CHAT_MODEL
+    CHAT_MODELS: str = ""
+    # rolling window per model and the error rate above which it is unhealthy
+    CHAT_ROUTER_WINDOW_SECONDS: float = 300
+    CHAT_ROUTER_MIN_SAMPLES: int = 5
+    CHAT_ROUTER_MAX_ERROR_RATE: float = 0.5
+    # send a second request to the next model after this delay, 0 disables it
+    CHAT_HEDGE_AFTER_MS: int = 0
+
+    # upstream (openrouter) http client, 0 read timeout means CHAT_REQUEST_TIME_OUT
+    UPSTREAM_HTTP2: bool = True
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30
+    UPSTREAM_CONNECT_TIMEOUT: float = 5
+    UPSTREAM_READ_TIMEOUT: float = 0
+    UPSTREAM_WRITE_TIMEOUT: float = 10
+    UPSTREAM_POOL_TIMEOUT: float = 5
+    UPSTREAM_MAX_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF: float = 0.2
+    UPSTREAM_RETRY_BACKOFF_MAX: float = 2
+    UPSTREAM_BREAKER_FAILURES: int = 5
+    UPSTREAM_BREAKER_RESET: float = 30
+
+    # chat message persistence, ack or async (see MESSAGE_WRITE_MODE)
+    MESSAGE_WRITE_MODE: str = "ack"
+    MESSAGE_FLUSH_SIZE: int = 100
+    MESSAGE_FLUSH_INTERVAL_MS: int = 50
+    # per-user recent messages kept in redis for get_user_chat_history
+    HISTORY_CACHE_SIZE: int = 100
+    HISTORY_CACHE_EXPIRE: int = 7 * 24 * 3600
+    # user behaviour analysis, 0 workers means one per cpu
+    ANALYSIS_WORKERS: int = 0
+    ANALYSIS_CACHE_EXPIRE: int = 24 * 3600
+    # per-user online topic model (hashing vectorizer + online LDA)
+    TOPIC_MODEL_FEATURES: int = 4096
+    TOPIC_MODEL_TOPICS: int = 5
+    TOPIC_MODEL_MAX_BATCH: int = 1000
+
+    # background pdf ingestion
+    INGEST_WORKERS: int = 2
+    INGEST_QUEUE_SIZE: int = 100
+    INGEST_JOB_EXPIRE: int = 24 * 3600
+    # one job ingests a content hash at a time, its claim lapses if not
+    # refreshed (by progress) for this many seconds
+    INGEST_CLAIM_TIMEOUT: int = 300
+    # chunks handed to the embedder at once, 0 means EMBEDDING_BATCH_SIZE *
+    # EMBEDDING_MAX_CONCURRENCY so every parallel request gets a batch
+    INGEST_EMBED_BATCH_SIZE: int = 0
+    # pages kept in memory for the ingestion summary
+    INGEST_SUMMARY_PAGES: int = 10
+    # page-level pdf extraction, 0 workers means one per cpu
+    PDF_EXTRACT_WORKERS: int = 0
+    PDF_EXTRACT_PAGES_PER_TASK: int = 8
+    # embedding cache misses, texts per request and parallel requests
+    EMBEDDING_BATCH_SIZE: int = 500
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    # per-document vector collections, 0 days means never expire
+    QA_INSTANCE_CACHE_SIZE: int = 32
+    DOCUMENT_EXPIRE_DAYS: int = 0
+    # semantic answer cache of /file_chat, 0 size disables it
+    SEMANTIC_CACHE_SIZE: int = 1000
+    SEMANTIC_CACHE_TTL: int = 3600
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95
+
+
+_settings: Optional[Settings] = None
+_settings_lock = threading.Lock()
+# long-lived components copy their tunables again on reload
+_reload_hooks: List[Callable[[Settings], None]] = []
+
+
+def get_settings() -> Settings:
+    """
+    the settings snapshot, .env.dev is only read on first use and on reload
+    """
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
+
+
+def on_settings_reload(hook: Callable[[Settings], None]):
+    """
+    register hook(settings) to run after every reload_settings
+    """
+    _reload_hooks.append(hook)
+    return hook
+
+
+def reload_settings() -> Settings:
+    """
+    values read per request take effect right away, components created at
+    startup apply what they can through on_settings_reload hooks; pool sizes,
+    the upstream client and DATABASE_URL still need a restart
+    """
+    global _settings
+    settings = Settings()
+    with _settings_lock:
+        _settings = settings
+    for hook in _reload_hooks:
+        try:
+            hook(settings)
+        except Exception:
+            logger.exception(f"settings reload hook {hook.__name__} error")
+    logger.info("settings reloaded")
+    return settings
+
+
+def install_reload_signal(loop):
+    # kill -HUP <pid> re-reads .env.dev without restarting the worker
+    if hasattr(signal, "SIGHUP"):
+        loop.add_signal_handler(signal.SIGHUP, reload_settings)
+
+
+async def verify_indexes(document_models=models.__all__):
+    """
+    make sure every index declared in the document Settings exists
+    """
+    for document_model in document_models:
+        declared = [
+            index.document["name"]
+            for index in getattr(document_model.Settings, "indexes", [])
+        ]
+        existing = await document_model.get_motor_collection().index_information()
+        missing = [name for name in declared if name not in existing]
+        if missing:
+            raise RuntimeError(
+                f"missing indexes on {document_model.Settings.name}: {missing}"
+            )
+
 
-    class Config:
-        env_file = ".env.dev"
-        orm_mode = True
+async def merge_duplicates_before_unique_indexes(database):
+    """
+    one-off migration: the unique (user_name, use_date) index on userlimits
+    can't be built while duplicate rows from the old deduct_userlimit exist
+    """
+    collection = database[UserLimits.Settings.name]
+    if "user_name_use_date" in await collection.index_information():
+        return
+    removed = await merge_duplicate_userlimits(collection)
+    if removed:
+        logger.warning(f"merged {removed} duplicate userlimits rows")
 
 
 async def initiate_database():
-    client = AsyncIOMotorClient(Settings().DATABASE_URL)
-    await init_beanie(
-        database=client.get_default_database(), document_models=models.__all__
-    )
+    client = AsyncIOMotorClient(get_settings().DATABASE_URL)
+    database = client.get_default_database()
+    await merge_duplicates_before_unique_indexes(database)
+    # init_beanie creates the indexes declared in the document models
+    await init_beanie(database=database, document_models=models.__all__)
+    await verify_indexes()
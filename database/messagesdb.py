@@ -1,4 +1,6 @@
-from typing import List
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
 
 from models.messages import Messages, MessagesModel
 
@@ -6,11 +8,28 @@ from models.messages import Messages, MessagesModel
 message_collection = Messages
 
 
+class MessageRow:
+    """
+    lightweight read-only message, no pydantic validation per row
+    """
+
+    __slots__ = ("type", "text", "ctime")
+
+    def __init__(self, type: str = None, text: str = None, ctime: int = None):
+        self.type = type
+        self.text = text
+        self.ctime = ctime
+
+
 async def add_message(new_message: Messages) -> Messages:
     message = await new_message.create()
     return message
 
 
+async def add_messages(new_messages: List[Messages]):
+    await message_collection.insert_many(new_messages)
+
+
 async def retrieve_messages(user_name: str, last_n: int) -> List[Messages]:
     messages = (
         await message_collection.find({"user_name": user_name})
@@ -21,10 +40,93 @@ async def retrieve_messages(user_name: str, last_n: int) -> List[Messages]:
     return messages
 
 
+async def retrieve_message_fields(
+    user_name: str, last_n: int, fields: Iterable[str] = ("type", "text", "ctime")
+) -> List[Dict]:
+    """
+    last_n messages, newest first, as raw dicts holding only `fields`
+    """
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = (
+        message_collection.get_motor_collection()
+        .find({"user_name": user_name}, projection)
+        .sort([("ctime", -1)])
+        .limit(last_n)
+    )
+    return await cursor.to_list(length=None)
+
+
+async def retrieve_message_rows(user_name: str, last_n: int) -> List[MessageRow]:
+    rows = await retrieve_message_fields(user_name, last_n)
+    return [MessageRow(**row) for row in rows]
+
+
 async def get_message_models(user_name: str, last_n: int) -> List[MessagesModel]:
-    messages = await retrieve_messages(user_name, last_n)
+    messages = await retrieve_message_rows(user_name, last_n)
 
     rets = [
         MessagesModel(type=item.type, text=item.text) for item in reversed(messages)
     ]
     return rets
+
+
+async def retrieve_messages_page(
+    user_name: str, limit: int, before: Optional[Tuple[int, ObjectId]] = None
+) -> List[Dict]:
+    """
+    newest first page of messages older than `before` (ctime, _id), keyset paginated
+    """
+    query = {"user_name": user_name}
+    if before:
+        before_ctime, before_id = before
+        query["$or"] = [
+            {"ctime": {"$lt": before_ctime}},
+            {"ctime": before_ctime, "_id": {"$lt": before_id}},
+        ]
+    cursor = (
+        message_collection.get_motor_collection()
+        .find(query, {"type": 1, "text": 1, "ctime": 1})
+        .sort([("ctime", -1), ("_id", -1)])
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def retrieve_messages_after(
+    user_name: str, after: Tuple[int, ObjectId], limit: int
+) -> List[Dict]:
+    """
+    oldest first messages newer than `after` (ctime, _id), for incremental updates
+    """
+    after_ctime, after_id = after
+    query = {
+        "user_name": user_name,
+        "$or": [
+            {"ctime": {"$gt": after_ctime}},
+            {"ctime": after_ctime, "_id": {"$gt": after_id}},
+        ],
+    }
+    cursor = (
+        message_collection.get_motor_collection()
+        .find(query, {"text": 1, "ctime": 1})
+        .sort([("ctime", 1), ("_id", 1)])
+        .limit(limit)
+    )
+    return await cursor.to_list(length=limit)
+
+
+async def iter_messages(user_name: str, batch_size: int = 500) -> AsyncIterator[Dict]:
+    """
+    all messages of a user, oldest first, streamed from the cursor
+    """
+    cursor = (
+        message_collection.get_motor_collection()
+        .find(
+            {"user_name": user_name},
+            {"_id": 0, "type": 1, "text": 1, "ctime": 1},
+            batch_size=batch_size,
+        )
+        .sort([("ctime", 1), ("_id", 1)])
+    )
+    async for row in cursor:
+        yield row
@@ -0,0 +1,49 @@
+import time
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+
+from models.useractivity import UserActivity
+
+
+useractivity_collection = UserActivity
+
+
+async def get_user_activity(user_name: str) -> Optional[UserActivity]:
+    return await useractivity_collection.find_one({"user_name": user_name})
+
+
+async def inc_user_activity(counts: Dict[str, Dict[str, int]]):
+    """
+    atomically add {user_name: {"hours.9": 1, "week_hours.45": 1}} counts
+    """
+    if not counts:
+        return
+    now = int(time.time() * 1000)
+    operations = [
+        UpdateOne(
+            {"user_name": user_name},
+            {"$inc": incs, "$set": {"mtime": now}},
+            upsert=True,
+        )
+        for user_name, incs in counts.items()
+    ]
+    await useractivity_collection.get_motor_collection().bulk_write(
+        operations, ordered=False
+    )
+
+
+async def set_user_activity(
+    user_name: str, hours: Dict[str, int], week_hours: Dict[str, int]
+):
+    await useractivity_collection.get_motor_collection().update_one(
+        {"user_name": user_name},
+        {
+            "$set": {
+                "hours": hours,
+                "week_hours": week_hours,
+                "mtime": int(time.time() * 1000),
+            }
+        },
+        upsert=True,
+    )
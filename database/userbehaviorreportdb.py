@@ -0,0 +1,28 @@
+from typing import List, Optional
+
+from pymongo import ReplaceOne
+
+from models.userbehaviorreport import UserBehaviorReport
+
+
+userbehaviorreport_collection = UserBehaviorReport
+
+
+async def get_user_behavior_report(user_name: str) -> Optional[UserBehaviorReport]:
+    return await userbehaviorreport_collection.find_one({"user_name": user_name})
+
+
+async def bulk_save_user_behavior_reports(reports: List[UserBehaviorReport]):
+    if not reports:
+        return
+    operations = [
+        ReplaceOne(
+            {"user_name": report.user_name},
+            report.model_dump(exclude={"id"}),
+            upsert=True,
+        )
+        for report in reports
+    ]
+    await userbehaviorreport_collection.get_motor_collection().bulk_write(
+        operations, ordered=False
+    )
@@ -1,7 +1,8 @@
 import time
-from typing import Union
+from typing import Dict, Tuple, Union
 
 from beanie import PydanticObjectId
+from pymongo import UpdateOne
 from models.userlimits import UserLimits
 
 
@@ -51,3 +52,69 @@ async def update_userlimit(id: PydanticObjectId, data: dict) -> Union[bool, User
         await obj.update(update_query)
         return obj
     return False
+
+
+async def bulk_set_userlimits(chat_cnts: Dict[Tuple[str, str], int]):
+    """
+    upsert chat_cnt of many (user_name, use_date) in one bulk write
+    """
+    if not chat_cnts:
+        return
+    now = int(time.time() * 1000)
+    operations = [
+        UpdateOne(
+            {"user_name": user_name, "use_date": use_date},
+            {
+                "$set": {"chat_cnt": chat_cnt, "mtime": now},
+                "$setOnInsert": {"ctime": now},
+            },
+            upsert=True,
+        )
+        for (user_name, use_date), chat_cnt in chat_cnts.items()
+    ]
+    await userlimits_collection.get_motor_collection().bulk_write(
+        operations, ordered=False
+    )
+
+
+async def merge_duplicate_userlimits(collection) -> int:
+    """
+    merge rows of the same (user_name, use_date) into one, summing chat_cnt,
+    left by the old read-then-insert deduct_userlimit; runs on the raw motor
+    collection before the unique index exists (and before init_beanie)
+
+    :return: number of rows removed
+    """
+    cursor = collection.aggregate(
+        [
+            {"$sort": {"_id": 1}},
+            {
+                "$group": {
+                    "_id": {"user_name": "$user_name", "use_date": "$use_date"},
+                    "ids": {"$push": "$_id"},
+                    "chat_cnt": {"$sum": "$chat_cnt"},
+                    "ctime": {"$min": "$ctime"},
+                    "mtime": {"$max": "$mtime"},
+                }
+            },
+            {"$match": {"ids.1": {"$exists": True}}},
+        ],
+        allowDiskUse=True,
+    )
+    removed = 0
+    async for group in cursor:
+        keep, duplicates = group["ids"][0], group["ids"][1:]
+        # delete first, a concurrent merge then no longer sees this group
+        result = await collection.delete_many({"_id": {"$in": duplicates}})
+        removed += result.deleted_count
+        await collection.update_one(
+            {"_id": keep},
+            {
+                "$set": {
+                    "chat_cnt": group["chat_cnt"],
+                    "ctime": group["ctime"],
+                    "mtime": group["mtime"],
+                }
+            },
+        )
+    return removed
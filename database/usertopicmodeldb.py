@@ -0,0 +1,54 @@
+import time
+from typing import Dict, Iterable, Optional
+
+from bson import Binary, ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from models.usertopicmodel import UserTopicModel
+
+
+usertopicmodel_collection = UserTopicModel
+
+
+async def get_user_topic_model(user_name: str) -> Optional[UserTopicModel]:
+    return await usertopicmodel_collection.find_one({"user_name": user_name})
+
+
+async def get_user_topic_models(user_names: Iterable[str]) -> Dict[str, UserTopicModel]:
+    models = await usertopicmodel_collection.find(
+        {"user_name": {"$in": list(user_names)}}
+    ).to_list()
+    return {model.user_name: model for model in models}
+
+
+async def save_user_topic_model(
+    user_name: str,
+    state: bytes,
+    n_docs: int,
+    last_ctime: int,
+    last_id: ObjectId,
+    version: int,
+) -> bool:
+    """
+    store the model if nobody else updated it since `version` was read,
+    returns False when it lost the race
+    """
+    data = {
+        "state": Binary(state),
+        "n_docs": n_docs,
+        "last_ctime": last_ctime,
+        "last_id": last_id,
+        "version": version + 1,
+        "mtime": int(time.time() * 1000),
+    }
+    collection = usertopicmodel_collection.get_motor_collection()
+    if version == 0:
+        try:
+            await collection.insert_one({"user_name": user_name, **data})
+            return True
+        except DuplicateKeyError:
+            return False
+    result = await collection.update_one(
+        {"user_name": user_name, "version": version}, {"$set": data}
+    )
+    return result.modified_count == 1
@@ -0,0 +1,74 @@
+"""
+Rebuild every user's activity histogram from the messages collection
+
+    python -m jobs.backfill_activity [--user-name meng]
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+from commons.costants import ANALYSIS_TIMEZONE
+from config.config import initiate_database
+from database.useractivitydb import set_user_activity
+from models.messages import Messages
+
+
+def activity_pipeline(user_name: str = None):
+    match = {"user_name": user_name} if user_name else {}
+    local_date = {"date": {"$toDate": "$ctime"}, "timezone": ANALYSIS_TIMEZONE}
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {
+                    "user_name": "$user_name",
+                    "hour": {"$hour": local_date},
+                    # 1 is sunday in mongo
+                    "day": {"$dayOfWeek": local_date},
+                },
+                "cnt": {"$sum": 1},
+            }
+        },
+        {"$sort": {"_id.user_name": 1}},
+    ]
+
+
+async def backfill(user_name: str = None):
+    await initiate_database()
+    start = time.time()
+    users = 0
+
+    current, hours, week_hours = None, defaultdict(int), defaultdict(int)
+    cursor = Messages.get_motor_collection().aggregate(
+        activity_pipeline(user_name), allowDiskUse=True
+    )
+    async for row in cursor:
+        if row["_id"]["user_name"] != current:
+            if current is not None:
+                await set_user_activity(current, dict(hours), dict(week_hours))
+                users += 1
+            current, hours, week_hours = (
+                row["_id"]["user_name"],
+                defaultdict(int),
+                defaultdict(int),
+            )
+        hour = row["_id"]["hour"]
+        # monday first, same as datetime.weekday()
+        weekday = (row["_id"]["day"] + 5) % 7
+        hours[str(hour)] += row["cnt"]
+        week_hours[str(weekday * 24 + hour)] += row["cnt"]
+    if current is not None:
+        await set_user_activity(current, dict(hours), dict(week_hours))
+        users += 1
+
+    logger.info(f"backfill activity: {users} users in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-name", default=None)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.user_name))
@@ -0,0 +1,176 @@
+"""
+Nightly behaviour analytics for every user, reports are served by /get_user_behavior
+
+    python -m jobs.behavior_report [--analysis-messages-count 100] [--workers 4]
+
+One aggregation pass over the messages (in user_name_ctime_id index order,
+MongoDB 5.2+ for $firstN) yields per user the newest ctime, the 24 hour
+activity histogram and the newest `analysis-messages-count` messages. Hours
+are bucketed like the live histogram (services.activity), the messages are
+folded into the user's online topic model like the endpoint does
+(services.topics), so a materialized report and a live one agree. Topic
+models are read per batch of users, the fitting runs in the analysis process
+pool (ANALYSIS_WORKERS), `--workers` bounds concurrent users.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from commons.costants import ANALYSIS_TIMEZONE
+from config.config import initiate_database
+from database.userbehaviorreportdb import bulk_save_user_behavior_reports
+from database.usertopicmodeldb import get_user_topic_models
+from models.messages import Messages
+from models.userbehaviorreport import UserBehaviorReport
+from models.usertopicmodel import UserTopicModel
+from services.activity import top_active_hours
+from services.analysis import run_in_analysis_pool, shutdown_analysis_pool
+from services.topics import fold_topic_rows, top_topic_terms
+
+
+def behavior_pipeline(analysis_messages_count: int):
+    local_date = {"date": {"$toDate": "$ctime"}, "timezone": ANALYSIS_TIMEZONE}
+    return [
+        # index order, the newest message of each user comes first
+        {"$sort": {"user_name": 1, "ctime": -1, "_id": -1}},
+        {
+            "$project": {
+                "user_name": 1,
+                "text": 1,
+                "ctime": 1,
+                "hour": {"$hour": local_date},
+            }
+        },
+        {
+            "$group": {
+                "_id": "$user_name",
+                "latest_ctime": {"$first": "$ctime"},
+                "messages": {"$sum": 1},
+                **{
+                    f"hour_{hour}": {
+                        "$sum": {"$cond": [{"$eq": ["$hour", hour]}, 1, 0]}
+                    }
+                    for hour in range(24)
+                },
+                "recent": {
+                    "$firstN": {
+                        "n": analysis_messages_count,
+                        "input": {"_id": "$_id", "text": "$text", "ctime": "$ctime"},
+                    }
+                },
+            }
+        },
+    ]
+
+
+def new_rows(row: Dict, stored: Optional[UserTopicModel]) -> List[Dict]:
+    """
+    the row's recent messages not yet in the stored topic model, oldest first
+    """
+    rows = list(reversed(row["recent"]))
+    if stored is None:
+        return rows
+    last = (stored.last_ctime, stored.last_id)
+    return [r for r in rows if (r["ctime"], r["_id"]) > last]
+
+
+class Progress:
+    def __init__(self, every: int = 1000):
+        self.every = every
+        self.users = 0
+        self.messages = 0
+        self.start = time.time()
+
+    def add(self, messages: int):
+        self.users += 1
+        self.messages += messages
+        if self.users % self.every == 0:
+            self.log()
+
+    def log(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        logger.info(
+            f"behavior report: {self.users} users, {self.messages} messages, "
+            f"{self.messages / elapsed:.1f} msgs/s, {self.users / elapsed:.1f} users/s"
+        )
+
+
+async def run(
+    analysis_messages_count: int,
+    active_hours_top_n: int,
+    active_topics_top_n: int,
+    workers: int,
+    write_batch_size: int = 500,
+):
+    await initiate_database()
+    progress = Progress()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def analyze(row, stored) -> Optional[UserBehaviorReport]:
+        async with semaphore:
+            try:
+                state = await fold_topic_rows(
+                    row["_id"], stored, new_rows(row, stored), run_in_analysis_pool
+                )
+            except Exception:
+                logger.exception(f"behavior report of {row['_id']} error")
+                return None
+        hours = {str(hour): row[f"hour_{hour}"] for hour in range(24)}
+        return UserBehaviorReport(
+            user_name=row["_id"],
+            analysis_messages_count=analysis_messages_count,
+            active_hours_top_n=active_hours_top_n,
+            active_topics_top_n=active_topics_top_n,
+            active_hours=top_active_hours(hours, active_hours_top_n),
+            active_topics=top_topic_terms(state, active_topics_top_n) if state else [],
+            latest_ctime=row["latest_ctime"],
+            ctime=int(time.time() * 1000),
+        )
+
+    async def save(rows):
+        # one topic model read per batch of users, not per user
+        stored = await get_user_topic_models(row["_id"] for row in rows)
+        reports = await asyncio.gather(
+            *(analyze(row, stored.get(row["_id"])) for row in rows)
+        )
+        await bulk_save_user_behavior_reports([r for r in reports if r is not None])
+        for row, report in zip(rows, reports):
+            if report is not None:
+                progress.add(row["messages"])
+
+    try:
+        cursor = Messages.get_motor_collection().aggregate(
+            behavior_pipeline(analysis_messages_count), allowDiskUse=True
+        )
+        rows = []
+        async for row in cursor:
+            rows.append(row)
+            if len(rows) >= write_batch_size:
+                await save(rows)
+                rows = []
+        if rows:
+            await save(rows)
+    finally:
+        shutdown_analysis_pool()
+    progress.log()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analysis-messages-count", type=int, default=100)
+    parser.add_argument("--active-hours-top-n", type=int, default=3)
+    parser.add_argument("--active-topics-top-n", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    asyncio.run(
+        run(
+            args.analysis_messages_count,
+            args.active_hours_top_n,
+            args.active_topics_top_n,
+            args.workers,
+        )
+    )
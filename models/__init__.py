@@ -1,4 +1,7 @@
 from models.messages import Messages
+from models.useractivity import UserActivity
+from models.userbehaviorreport import UserBehaviorReport
 from models.userlimits import UserLimits
+from models.usertopicmodel import UserTopicModel
 
-__all__ = [Messages, UserLimits]
+__all__ = [Messages, UserActivity, UserBehaviorReport, UserLimits, UserTopicModel]
@@ -4,14 +4,14 @@ from pydantic import BaseModel
 
 from commons.costants import HTTP_STATUS_CODE_200_OK
 from commons.enums import MIDDLE_OUT_MODE
-from config.config import Settings
 
 
 class ChatReq(BaseModel):
     message: str
     user_name: str
     middle_out_mode: Optional[str] = MIDDLE_OUT_MODE.TRIM
-    max_tokens: Optional[int] = int(Settings().TEXT_HANDLE_MAX_TOKENS)
+    # None means TEXT_HANDLE_MAX_TOKENS, read per request so a reload applies
+    max_tokens: Optional[int] = None
 
 
 class AdvancedChatReq(ChatReq):
@@ -33,3 +33,17 @@ class Response(BaseModel):
 
 class FileChatReq(BaseModel):
     message: str
+    document_id: str
+
+
+class IngestJobModel(BaseModel):
+    job_id: str
+    document_id: str
+    status: str
+    file_name: str
+    num_bytes: int
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    summary: Optional[str] = None
+    error: Optional[str] = None
@@ -1,5 +1,8 @@
+from typing import List, Optional
+
 from beanie import Document
 from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING, IndexModel
 
 
 class MessagesModel(BaseModel):
@@ -7,6 +10,12 @@ class MessagesModel(BaseModel):
     text: str
 
 
+class MessagesPage(BaseModel):
+    messages: List[MessagesModel]
+    # pass back as `cursor` to get the previous (older) page
+    next_cursor: Optional[str] = None
+
+
 class Messages(Document):
     user_name: str
     type: str
@@ -27,3 +36,15 @@ class Messages(Document):
 
     class Settings:
         name = "messages"
+        indexes = [
+            # retrieve_messages: filter by user_name, sort by ctime desc,
+            # _id breaks ties for keyset pagination
+            IndexModel(
+                [
+                    ("user_name", ASCENDING),
+                    ("ctime", DESCENDING),
+                    ("_id", DESCENDING),
+                ],
+                name="user_name_ctime_id",
+            ),
+        ]
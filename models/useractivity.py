@@ -0,0 +1,29 @@
+from typing import Dict
+
+from beanie import Document
+from pymongo import ASCENDING, IndexModel
+
+
+class UserActivity(Document):
+    user_name: str
+    # message count per local hour, "0".."23"
+    hours: Dict[str, int] = {}
+    # message count per local weekday and hour, "0".."167" (monday 0:00 is "0")
+    week_hours: Dict[str, int] = {}
+    mtime: int = 0
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "user_name": "meng",
+                "hours": {"9": 12, "21": 30},
+                "week_hours": {"9": 2, "45": 10},
+                "mtime": 1706275357000,
+            }
+        }
+
+    class Settings:
+        name = "useractivity"
+        indexes = [
+            IndexModel([("user_name", ASCENDING)], name="user_name", unique=True),
+        ]
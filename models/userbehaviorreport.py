@@ -0,0 +1,37 @@
+from typing import List
+
+from beanie import Document
+from pymongo import ASCENDING, IndexModel
+
+
+class UserBehaviorReport(Document):
+    user_name: str
+    # parameters the report was computed with
+    analysis_messages_count: int
+    active_hours_top_n: int
+    active_topics_top_n: int
+    active_hours: List[str]
+    active_topics: List[str]
+    # newest message ctime covered by the report
+    latest_ctime: int
+    ctime: int
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "user_name": "meng",
+                "analysis_messages_count": 100,
+                "active_hours_top_n": 3,
+                "active_topics_top_n": 3,
+                "active_hours": ["1:00-2:00", "2:00-3:00", "17:00-18:00"],
+                "active_topics": ["member", "friend", "help"],
+                "latest_ctime": 1706275357000,
+                "ctime": 1706275357000,
+            }
+        }
+
+    class Settings:
+        name = "userbehaviorreports"
+        indexes = [
+            IndexModel([("user_name", ASCENDING)], name="user_name", unique=True),
+        ]
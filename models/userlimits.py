@@ -1,5 +1,6 @@
 from beanie import Document
 from pydantic import BaseModel
+from pymongo import ASCENDING, IndexModel
 
 
 class UserLimitModel(BaseModel):
@@ -27,3 +28,11 @@ class UserLimits(Document):
 
     class Settings:
         name = "userlimits"
+        indexes = [
+            # one usage record per user per day
+            IndexModel(
+                [("user_name", ASCENDING), ("use_date", ASCENDING)],
+                name="user_name_use_date",
+                unique=True,
+            ),
+        ]
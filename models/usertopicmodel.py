@@ -0,0 +1,23 @@
+from typing import Optional
+
+from beanie import Document, PydanticObjectId
+from pymongo import ASCENDING, IndexModel
+
+
+class UserTopicModel(Document):
+    user_name: str
+    # compressed pickle of the online LDA and the hash bucket -> term map
+    state: bytes
+    n_docs: int = 0
+    # keyset position (ctime, _id) of the last message fitted
+    last_ctime: int = 0
+    last_id: Optional[PydanticObjectId] = None
+    # optimistic lock, concurrent updates of the same user don't double count
+    version: int = 0
+    mtime: int = 0
+
+    class Settings:
+        name = "usertopicmodels"
+        indexes = [
+            IndexModel([("user_name", ASCENDING)], name="user_name", unique=True),
+        ]
@@ -1,15 +1,38 @@
-from fastapi import Body, APIRouter, HTTPException, FastAPI, UploadFile, File, Depends
+from fastapi import (
+    Body,
+    APIRouter,
+    HTTPException,
+    FastAPI,
+    UploadFile,
+    File,
+    Depends,
+)
 from commons.costants import HTTP_STATUS_CODE_200_OK
 from models.api import FileChatReq, Response
-from services.chatpdf import feed_data, pdf_chat
+from services.chatpdf import delete_document, document_exists, pdf_chat
+from services.ingestion import get_job, ingest_queue
 
+import asyncio
+import contextlib
+import hashlib
 import os
+import uuid
 
 router = APIRouter()
 
 
 SAVE_DIR = "./tmpdata/"
 MAX_FILE_SIZE_MB = 50
+FILE_TOO_LARGE = f"File size exceeds the maximum allowed size of {MAX_FILE_SIZE_MB} MB"
+# a little room for the multipart boundaries and headers, enforced on the raw
+# request body by BodySizeLimitMiddleware (see app.py)
+MAX_UPLOAD_REQUEST_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024 + 4096
+UPLOAD_PATHS = ("/upload_files",)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _file_too_large():
+    return HTTPException(status_code=400, detail=FILE_TOO_LARGE)
 
 
 async def check_file(file: UploadFile = File(...)):
@@ -23,17 +46,42 @@ async def check_file(file: UploadFile = File(...)):
         raise HTTPException(
             status_code=400, detail="Only pdf and txt files are allowed"
         )
-
-    # check file size
-    file_size_mb = os.path.getsize(file.filename) / (1024 * 1024)
-    if file_size_mb > MAX_FILE_SIZE_MB:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File size exceeds the maximum allowed size of {MAX_FILE_SIZE_MB} MB",
-        )
     return file
 
 
+async def save_upload_file(file: UploadFile):
+    """
+    copy the spooled upload to SAVE_DIR in fixed-size chunks, hashing on the
+    way; the request body limit is enforced earlier by the middleware, this
+    checks the size of the file part itself
+
+    :return: (file path, size in bytes, sha256 hex digest)
+    """
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    sha256 = hashlib.sha256()
+    num_bytes = 0
+    part_path = os.path.join(SAVE_DIR, uuid.uuid4().hex + ".part")
+    try:
+        with open(part_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                num_bytes += len(chunk)
+                if num_bytes > max_bytes:
+                    raise _file_too_large()
+                sha256.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        # open() itself may have failed, keep the original error
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(part_path)
+        raise
+    # content addressed, concurrent uploads of the same name don't clash
+    file_hash = sha256.hexdigest()
+    file_path = os.path.join(SAVE_DIR, file_hash + ".pdf")
+    os.replace(part_path, file_path)
+    return file_path, num_bytes, file_hash
+
+
 @router.post(
     "/upload_files",
     response_model=Response,
@@ -41,7 +89,7 @@ async def check_file(file: UploadFile = File(...)):
 )
 async def create_upload_file(file: UploadFile = Depends(check_file)):
     """
-    上传文件，并解析开启AI对话
+    上传文件，后台解析后开启AI对话，通过 /upload_jobs/{job_id} 查询解析进度和摘要
 
     Description:
     ...
@@ -53,28 +101,63 @@ async def create_upload_file(file: UploadFile = Depends(check_file)):
 
     ```
     {
+        "job_id": "0f8fad5bd9cb469fa16570867728950e",
+        "document_id": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
         "sourceInfo": {
             "displayName": "xxx.pdf",
             "numBytes": 1024,
-        },
-        "summary": "this is a summary"
+        }
     }
     ```
     """
     # handle save file
-    file_path = os.path.join(SAVE_DIR, file.filename)
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    # load data to llm
-    summary = await feed_data(file_path)
-
-    # show file metadata
+    file_path, num_bytes, file_hash = await save_upload_file(file)
+    # load data to llm in the background
     file_name = file.filename
-    file_size_mb = os.path.getsize(file.filename) / (1024 * 1024)
+    job_id = await ingest_queue.submit(file_path, file_name, num_bytes, file_hash)
+
+    return {
+        "code": HTTP_STATUS_CODE_200_OK,
+        "data": {
+            "job_id": job_id,
+            "document_id": file_hash,
+            "sourceInfo": {"displayName": file_name, "numBytes": num_bytes},
+        },
+    }
+
+
+@router.get(
+    "/upload_jobs/{job_id}",
+    response_model=Response,
+    summary="Upload file ingestion status",
+)
+async def get_upload_job(job_id: str):
+    """
+    查询上传文件的解析进度，完成后返回摘要
+
+    Response Body:
+
+    ```
+    {
+        "job_id": "0f8fad5bd9cb469fa16570867728950e",
+        "document_id": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+        "status": "running",
+        "file_name": "xxx.pdf",
+        "num_bytes": 1024,
+        "pages_parsed": 12,
+        "chunks_total": 300,
+        "chunks_embedded": 100,
+        "summary": null,
+        "error": null
+    }
+    ```
+    """
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
     return {
-        "sourceInfo": {"displayName": file_name, "numBytes": file_size_mb},
-        "summary": summary,
+        "code": HTTP_STATUS_CODE_200_OK,
+        "data": job,
     }
 
 
@@ -92,6 +175,7 @@ async def file_chat(req: FileChatReq = Body(...)):
 
     Request body:
     - message 用户输入的聊天内容 **required**
+    - document_id 上传文件返回的 document_id，只在该文件内检索 **required**
 
     Response body:
     - code 请求操作内部响应码
@@ -103,3 +187,21 @@ async def file_chat(req: FileChatReq = Body(...)):
         "code": HTTP_STATUS_CODE_200_OK,
         "data": ret,
     }
+
+
+@router.delete(
+    "/documents/{document_id}",
+    response_model=Response,
+    summary="Delete uploaded file",
+)
+async def delete_uploaded_document(document_id: str):
+    """
+    删除上传文件的向量数据，之后无法再与该文件对话
+    """
+    if not await asyncio.to_thread(document_exists, document_id):
+        raise HTTPException(status_code=404, detail="document not found")
+    await asyncio.to_thread(delete_document, document_id)
+    return {
+        "code": HTTP_STATUS_CODE_200_OK,
+        "data": {"document_id": document_id},
+    }
@@ -2,23 +2,23 @@ from datetime import datetime
 import time
 from typing import Optional
 from fastapi import Body, APIRouter, HTTPException
-from httpx import AsyncClient
+from fastapi.responses import StreamingResponse
 from passlib.context import CryptContext
-from commons.costants import HTTP_STATUS_CODE_200_OK
+from commons.costants import HTTP_STATUS_CODE_200_OK, HTTP_STATUS_CODE_400_BAD_REQUEST
 from models.api import AdvancedChatReq, ChatReq, Response
-from services.analysis import (
-    analyze_most_active_time_period,
-    analyze_most_active_topics,
-)
+from services.analysis import analyze_user_behavior
 from services.messages import (
     ai_chat,
     ai_chat_advanced,
+    ai_chat_stream,
+    export_chat_history,
     get_chat_history,
+    get_chat_history_page,
     get_chat_status_today_by,
 )
+from vendor.openrouter import get_upstream_client
 
 router = APIRouter()
-client = AsyncClient()
 
 hash_helper = CryptContext(schemes=["bcrypt"])
 
@@ -48,13 +48,48 @@ async def get_ai_chat_response(req: ChatReq = Body(...)):
     - data 请求响应内容
         - response AI 的本次问题回答
     """
-    ret = await ai_chat(client, req)
+    ret = await ai_chat(get_upstream_client(), req)
     return {
         "code": HTTP_STATUS_CODE_200_OK,
         "data": ret,
     }
 
 
+@router.post(
+    "/get_ai_chat_response_stream",
+    summary="AI 对话(流式, SSE)",
+)
+async def get_ai_chat_response_stream(req: ChatReq = Body(...)):
+    """
+
+    Description:
+    - 用户输入问题，以 Server-Sent Events 流式返回 AI 的回答，边生成边返回
+    - 回答结束(或客户端断开)后保存 AI 消息，未返回任何内容时不计入当天聊天次数
+
+    Request body:
+    - 同 /get_ai_chat_response
+
+    Response body:
+
+    ```
+    data: {"content": "Hi Eric"}
+
+    data: {"content": ", what can I do for you!"}
+
+    data: [DONE]
+    ```
+
+    出错时返回 **event: error**，data 为 {"detail": "错误信息"}
+    """
+    events = await ai_chat_stream(get_upstream_client(), req)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        # no caching / proxy buffering, every event goes out right away
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get(
     "/get_user_chat_history",
     response_model=Response,
@@ -91,6 +126,76 @@ async def get_user_chat_history(user_name: str, last_n: int):
     }
 
 
+@router.get(
+    "/get_user_chat_history_page",
+    response_model=Response,
+    summary="分页查询用户聊天记录",
+)
+async def get_user_chat_history_page(
+    user_name: str, limit: Optional[int] = 20, cursor: Optional[str] = None
+):
+    """
+    Description:
+    - 按时间倒序分页查询用户的聊天记录，每页内按时间正序返回
+
+    Query Params:
+    - user_name 聊天的人名字 **required**
+    - limit 每页条数，默认20 **optional**
+    - cursor 上一页返回的 next_cursor，不传则从最新一条开始 **optional**
+
+    Response Body:
+
+    ```
+    {
+        "messages": [
+            {
+                "type": "user",
+                "text": "hi, my name is Eric"
+            },
+            {
+                "type": "ai",
+                "text": "Hi Eric, what can I do for you!"
+            }
+        ],
+        "next_cursor": "1706275357000_65b3a1f2c9e77c0001a1b2c3"
+    }
+    ```
+    """
+    if limit <= 0:
+        raise HTTPException(
+            status_code=HTTP_STATUS_CODE_400_BAD_REQUEST, detail="limit must be > 0"
+        )
+    page = await get_chat_history_page(user_name, limit, cursor)
+    return {
+        "code": HTTP_STATUS_CODE_200_OK,
+        "data": page,
+    }
+
+
+@router.get(
+    "/export_user_chat_history",
+    summary="导出用户全部聊天记录(NDJSON)",
+)
+async def export_user_chat_history(user_name: str):
+    """
+    Description:
+    - 以 NDJSON 流式导出用户全部聊天记录，按时间正序，每行一条
+
+    Query Params:
+    - user_name 聊天的人名字 **required**
+
+    Response Body:
+
+    ```
+    {"type": "user", "text": "hi, my name is Eric", "ctime": 1706275357000}
+    {"type": "ai", "text": "Hi Eric, what can I do for you!", "ctime": 1706275358000}
+    ```
+    """
+    return StreamingResponse(
+        export_chat_history(user_name), media_type="application/x-ndjson"
+    )
+
+
 @router.get("/get_chat_status_today", response_model=Response, summary="查询用户当天聊天次数")
 async def get_chat_status_today(user_name: str):
     """
@@ -145,7 +250,7 @@ async def get_ai_chat_response_advanced(req: AdvancedChatReq = Body(...)):
     - data 请求响应内容
         - response AI 的本次问题回答
     """
-    ret = await ai_chat_advanced(client, req)
+    ret = await ai_chat_advanced(get_upstream_client(), req)
     return {
         "code": HTTP_STATUS_CODE_200_OK,
         "data": ret,
@@ -195,16 +300,10 @@ async def get_user_behavior(
     }
     ```
     """
-    active_hours = await analyze_most_active_time_period(
-        user_name, analysis_messages_count, active_hours_top_n
-    )
-    active_topics = await analyze_most_active_topics(
-        user_name, analysis_messages_count, active_topics_top_n
+    report = await analyze_user_behavior(
+        user_name, analysis_messages_count, active_hours_top_n, active_topics_top_n
     )
     return {
         "code": HTTP_STATUS_CODE_200_OK,
-        "data": {
-            "active_hours": active_hours,
-            "active_topics": active_topics,
-        },
+        "data": report,
     }
@@ -0,0 +1,49 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List
+from zoneinfo import ZoneInfo
+
+from loguru import logger
+
+from commons.costants import ANALYSIS_TIMEZONE
+from database.useractivitydb import get_user_activity, inc_user_activity
+from models.messages import Messages
+
+_tz = ZoneInfo(ANALYSIS_TIMEZONE)
+
+
+def activity_buckets(ctime: int):
+    """
+    (hour, weekday * 24 + hour) of a message ctime in ANALYSIS_TIMEZONE
+    """
+    local = datetime.fromtimestamp(ctime / 1000, _tz)
+    return local.hour, local.weekday() * 24 + local.hour
+
+
+async def record_activity(messages: Iterable[Messages]):
+    """
+    add newly stored messages to their users' activity histograms
+    """
+    counts: Dict[str, Counter] = defaultdict(Counter)
+    for message in messages:
+        hour, week_hour = activity_buckets(message.ctime)
+        counts[message.user_name][f"hours.{hour}"] += 1
+        counts[message.user_name][f"week_hours.{week_hour}"] += 1
+    try:
+        await inc_user_activity(counts)
+    except Exception:
+        # the backfill job rebuilds histograms from messages
+        logger.exception("record user activity error")
+
+
+def top_active_hours(hours: Dict[str, int], active_hours_top_n: int) -> List[str]:
+    top = sorted(hours.items(), key=lambda item: (-item[1], int(item[0])))
+    active_hours = [int(hour) for hour, cnt in top[:active_hours_top_n] if cnt > 0]
+    return [f"{hour}:00-{hour+1}:00" for hour in sorted(active_hours)]
+
+
+async def get_active_hours(user_name: str, active_hours_top_n: int) -> List[str]:
+    activity = await get_user_activity(user_name)
+    if not activity:
+        return []
+    return top_active_hours(activity.hours, active_hours_top_n)
@@ -1,47 +1,136 @@
-from typing import List
+import asyncio
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
 
-import pandas as pd
+from loguru import logger
 
-from database.messagesdb import retrieve_messages
+from config.config import get_settings
+from database.messagesdb import retrieve_message_fields
+from database.userbehaviorreportdb import get_user_behavior_report
+from services.activity import get_active_hours
+from services.topics import top_topic_terms, update_topic_model
+from vendor.redis import aget, aset
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
+_analysis_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_analysis_pool() -> ProcessPoolExecutor:
+    global _analysis_pool
+    if _analysis_pool is None:
+        # spawn, not fork: a fork taken while the summarizer or torch threads
+        # hold a lock can deadlock the child
+        _analysis_pool = ProcessPoolExecutor(
+            max_workers=get_settings().ANALYSIS_WORKERS or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _analysis_pool
+
+
+def shutdown_analysis_pool():
+    global _analysis_pool
+    if _analysis_pool is not None:
+        _analysis_pool.shutdown(wait=False, cancel_futures=True)
+        _analysis_pool = None
+
+
+async def run_in_analysis_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_analysis_pool(), func, *args)
 
 
 async def analyze_most_active_topics(
     user_name: str, analysis_messages_count: int, active_topics_top_n: int
 ) -> List[str]:
-    chat_records = await retrieve_messages(user_name, analysis_messages_count)
-    if not chat_records or len(chat_records) <= 0:
-        return {"active_topics": []}
-    chat_msg_records = [item.text for item in reversed(chat_records)]
-    vectorizer = CountVectorizer(max_df=0.95, min_df=1, stop_words="english")
-    term_matrix = vectorizer.fit_transform(chat_msg_records)
-    lda = LatentDirichletAllocation(n_components=active_topics_top_n, random_state=0)
-    lda.fit(term_matrix)
-
-    return [
-        vectorizer.get_feature_names_out()[i]
-        for i in lda.components_[0].argsort()[-active_topics_top_n:]
-    ]
+    # only messages newer than the stored model are fitted
+    state = await update_topic_model(
+        user_name, analysis_messages_count, run_in_analysis_pool
+    )
+    if not state:
+        return []
+    return top_topic_terms(state, active_topics_top_n)
 
 
 async def analyze_most_active_time_period(
     user_name: str,
     analysis_messages_count: int,
     active_hours_top_n: int,
-) -> str:
-    chat_records = await retrieve_messages(user_name, analysis_messages_count)
-    if not chat_records or len(chat_records) <= 0:
-        return {"active_hours": []}
-
-    timestamps = pd.to_datetime(
-        [
-            pd.Timestamp(record.ctime, unit="ms", tz="Asia/Shanghai")
-            for record in chat_records
-        ]
+) -> List[str]:
+    # top-k over the incrementally maintained 24 hour histogram, all history
+    return await get_active_hours(user_name, active_hours_top_n)
+
+
+async def compute_user_behavior(
+    user_name: str,
+    analysis_messages_count: int,
+    active_hours_top_n: int,
+    active_topics_top_n: int,
+) -> Dict:
+    """
+    uncached report, shared by the endpoint and jobs.behavior_report
+    """
+    return {
+        "active_hours": await analyze_most_active_time_period(
+            user_name, analysis_messages_count, active_hours_top_n
+        ),
+        "active_topics": await analyze_most_active_topics(
+            user_name, analysis_messages_count, active_topics_top_n
+        ),
+    }
+
+
+def _behavior_key(user_name: str, *params) -> str:
+    return "user:behavior:" + ":".join(str(p) for p in params) + ":" + user_name
+
+
+async def analyze_user_behavior(
+    user_name: str,
+    analysis_messages_count: int,
+    active_hours_top_n: int,
+    active_topics_top_n: int,
+) -> Dict:
+    """
+    active hours and topics of the user, cached until a newer message arrives
+    """
+    # newest ctime is an index only lookup, it versions the cached report
+    latest = await retrieve_message_fields(user_name, 1, ("ctime",))
+    if not latest:
+        return {"active_hours": [], "active_topics": []}
+    key = _behavior_key(
+        user_name,
+        latest[0]["ctime"],
+        analysis_messages_count,
+        active_hours_top_n,
+        active_topics_top_n,
     )
-    active_hours = (
-        timestamps.hour.value_counts().nlargest(active_hours_top_n).index.tolist()
+    try:
+        cached = await aget(key)
+    except Exception:
+        logger.exception("read behavior cache error")
+        cached = None
+    if cached is not None:
+        return json.loads(cached)
+
+    # materialized by jobs.behavior_report, valid while no newer message arrived
+    materialized = await get_user_behavior_report(user_name)
+    if (
+        materialized
+        and materialized.latest_ctime == latest[0]["ctime"]
+        and materialized.analysis_messages_count == analysis_messages_count
+        and materialized.active_hours_top_n == active_hours_top_n
+        and materialized.active_topics_top_n == active_topics_top_n
+    ):
+        return {
+            "active_hours": materialized.active_hours,
+            "active_topics": materialized.active_topics,
+        }
+
+    report = await compute_user_behavior(
+        user_name, analysis_messages_count, active_hours_top_n, active_topics_top_n
     )
-    return [f"{hour}:00-{hour+1}:00" for hour in sorted(active_hours)]
+    try:
+        await aset(key, json.dumps(report), get_settings().ANALYSIS_CACHE_EXPIRE)
+    except Exception:
+        logger.exception("write behavior cache error")
+    return report
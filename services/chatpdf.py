@@ -1,7 +1,24 @@
-from langchain_community.document_loaders import PyPDFLoader
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import chromadb
+import chromadb.errors
+from fastapi import HTTPException
+
+from config.config import get_settings
 from models.api import FileChatReq
+from services.embeddings import (
+    delete_ingested_file,
+    get_embeddings,
+    iter_ingested_files,
+)
+from services.pdfextract import iter_pages
+from services.semanticcache import semantic_cache
+from vendor.redis import aget, incr
 
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.llms import OpenAI
@@ -13,41 +30,218 @@ from langchain_openai import ChatOpenAI
 
 DB_NAME = "./db/chroma_db"
 
+_chroma_client = None
+_qa_llm = None
+_summarize_instance = None
+# per-document (version, RetrievalQA), most recently used last
+_qa_instances: "OrderedDict[str, Tuple[str, RetrievalQA]]" = OrderedDict()
+_qa_instances_lock = threading.Lock()
+
+# unknown collection: ValueError in older chromadb, its own errors in newer ones
+_COLLECTION_NOT_FOUND = (ValueError,) + tuple(
+    getattr(chromadb.errors, name)
+    for name in ("NotFoundError", "InvalidCollectionException")
+    if hasattr(chromadb.errors, name)
+)
+
+
+def get_chroma_client():
+    global _chroma_client
+    if _chroma_client is None:
+        _chroma_client = chromadb.PersistentClient(path=DB_NAME)
+    return _chroma_client
+
+
+def collection_name(document_id: str) -> str:
+    # chroma collection names are at most 63 characters
+    return "doc-" + document_id[:48]
+
+
+def get_docsearch(document_id: str) -> Chroma:
+    return Chroma(
+        collection_name=collection_name(document_id),
+        embedding_function=get_embeddings(),
+        persist_directory=DB_NAME,
+        client=get_chroma_client(),
+    )
+
+
+def _version_key(document_id: str) -> str:
+    return "document:version:" + document_id
+
+
+async def get_document_version(document_id: str) -> str:
+    """
+    bumped by every delete, tells the workers their cached chains are stale
+    """
+    return await aget(_version_key(document_id)) or "0"
+
+
+def document_exists(document_id: str) -> bool:
+    try:
+        get_chroma_client().get_collection(collection_name(document_id))
+    except _COLLECTION_NOT_FOUND:
+        return False
+    return True
+
+
+def _drop_cached(document_id: str):
+    with _qa_instances_lock:
+        _qa_instances.pop(document_id, None)
+    semantic_cache.invalidate(document_id)
 
-async def feed_data(file_path: str) -> str:
-    # document loader to load data
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
+
+def delete_document(document_id: str):
+    """
+    drop the document's vectors, re-uploading the file ingests it again
+    """
+    _drop_cached(document_id)
+    if document_exists(document_id):
+        get_chroma_client().delete_collection(collection_name(document_id))
+    delete_ingested_file(document_id)
+    # other workers drop their chains and answers on their next chat
+    incr(_version_key(document_id))
+
+
+def expire_documents(max_age_seconds: int) -> List[str]:
+    """
+    delete documents ingested more than `max_age_seconds` ago
+    """
+    deadline = int(time.time()) - max_age_seconds
+    expired = [
+        document_id
+        for document_id, ingested in iter_ingested_files()
+        if ingested.get("ctime", 0) < deadline
+    ]
+    for document_id in expired:
+        delete_document(document_id)
+    return expired
+
+
+async def _no_progress(**fields):
+    pass
+
+
+async def feed_data(
+    file_path: str,
+    document_id: str,
+    progress: Optional[Callable[..., Awaitable]] = None,
+) -> str:
+    """
+    stream pdf pages through split -> embed -> persist into the document's own
+    collection, then summarize it,
+    only one span of chunks and the summary pages are held in memory
+    """
+    settings = get_settings()
+    progress = progress or _no_progress
     # text split by characters
     text_splitter = CharacterTextSplitter(chunk_size=200, chunk_overlap=0)
-    split_docs = text_splitter.split_documents(documents)
-    # text embedding by model
-    embeddings = OpenAIEmbeddings()
+    # persist embedding by db(chromadb), one collection per document,
+    # chunks embedded before are read from the embedding cache
+    docsearch = get_docsearch(document_id)
+    # answers cached for an earlier ingestion of this document are stale
+    semantic_cache.invalidate(document_id)
 
-    # persist embedding by db(chromadb)
-    docsearch = Chroma.from_documents(split_docs, embeddings, persist_directory=DB_NAME)
-    docsearch.persist()
+    span = settings.INGEST_EMBED_BATCH_SIZE or (
+        settings.EMBEDDING_BATCH_SIZE * settings.EMBEDDING_MAX_CONCURRENCY
+    )
+    summary_pages, batch = [], []
+    pages_parsed, chunks_embedded = 0, 0
 
-    return text_summarize()
+    async def embed(batch):
+        await asyncio.to_thread(docsearch.add_documents, batch)
+        return len(batch)
 
+    # pages are parsed in worker processes while the previous batch is embedded
+    async for page in iter_pages(file_path):
+        pages_parsed += 1
+        if len(summary_pages) < settings.INGEST_SUMMARY_PAGES:
+            summary_pages.append(page)
+        batch.extend(text_splitter.split_documents([page]))
+        if len(batch) >= span:
+            chunks_embedded += await embed(batch)
+            batch = []
+        await progress(pages_parsed=pages_parsed, chunks_embedded=chunks_embedded)
+    if batch:
+        chunks_embedded += await embed(batch)
+    await asyncio.to_thread(docsearch.persist)
+    await progress(
+        pages_parsed=pages_parsed,
+        chunks_total=chunks_embedded,
+        chunks_embedded=chunks_embedded,
+    )
 
-def initialize_qa_instance():
-    # load embedding from db
-    embeddings = OpenAIEmbeddings()
-    docsearch = Chroma(persist_directory=DB_NAME, embedding_function=embeddings)
-    # create LLM
-    llm = OpenAI(temperature=0, verbose=True, max_tokens=1000)
+    return await text_summarize(summary_pages)
+
+
+def get_qa_llm() -> OpenAI:
+    # created on first use, not at import
+    global _qa_llm
+    if _qa_llm is None:
+        _qa_llm = OpenAI(temperature=0, verbose=True, max_tokens=1000)
+    return _qa_llm
+
+
+def initialize_qa_instance(document_id: str):
+    # load embedding from db, only this document's collection is searched
+    docsearch = get_docsearch(document_id)
     # create a retrievers to QA
     return RetrievalQA.from_chain_type(
-        llm=llm, chain_type="stuff", retriever=docsearch.as_retriever()
+        llm=get_qa_llm(), chain_type="stuff", retriever=docsearch.as_retriever()
     )
 
 
-qa_instance = initialize_qa_instance()
+def get_qa_instance(document_id: str, version: str = "0") -> RetrievalQA:
+    with _qa_instances_lock:
+        cached = _qa_instances.get(document_id)
+        if cached is not None and cached[0] == version:
+            _qa_instances.move_to_end(document_id)
+            return cached[1]
+    if cached is not None:
+        # deleted (and maybe ingested again) by another worker since cached
+        _drop_cached(document_id)
+    if not document_exists(document_id):
+        raise HTTPException(status_code=404, detail="document not found")
+    qa_instance = initialize_qa_instance(document_id)
+    evicted = []
+    with _qa_instances_lock:
+        _qa_instances[document_id] = (version, qa_instance)
+        while len(_qa_instances) > get_settings().QA_INSTANCE_CACHE_SIZE:
+            evicted.append(_qa_instances.popitem(last=False)[0])
+    # answers live only as long as their chain, so a version change is never missed
+    for evicted_id in evicted:
+        semantic_cache.invalidate(evicted_id)
+    return qa_instance
+
+
+async def answer_by_vector(qa_instance: RetrievalQA, question: str, vector) -> str:
+    """
+    RetrievalQA with the question already embedded, retrieval reuses the vector
+    """
+    retriever = qa_instance.retriever
+    docs = await retriever.vectorstore.asimilarity_search_by_vector(
+        vector, **retriever.search_kwargs
+    )
+    return await qa_instance.combine_documents_chain.arun(
+        input_documents=docs, question=question
+    )
 
 
 async def pdf_chat(req: FileChatReq):
-    result = qa_instance.run(req.message)
+    # once per request, a settings reload may resize the cache meanwhile
+    use_cache = semantic_cache.max_entries > 0
+    version = await get_document_version(req.document_id)
+    qa_instance = await asyncio.to_thread(get_qa_instance, req.document_id, version)
+    if not use_cache:
+        # async retrieval and completion, concurrent chats don't block each other
+        return {"response": await qa_instance.arun(req.message)}
+    # a near-identical question on the same document was answered before
+    vector = await get_embeddings().aembed_query(req.message)
+    cached = semantic_cache.get(req.document_id, vector)
+    if cached is not None:
+        return {"response": cached}
+    result = await answer_by_vector(qa_instance, req.message, vector)
+    semantic_cache.put(req.document_id, req.message, vector, result)
     # to use long context chat, see: https://python.langchain.com/docs/modules/data_connection/retrievers/long_context_reorder
     return {"response": result}
 
@@ -67,8 +261,12 @@ def init_summarize_instance():
     return StuffDocumentsChain(llm_chain=llm_chain, document_variable_name="text")
 
 
-summarize_instance = init_summarize_instance()
+def get_summarize_instance() -> StuffDocumentsChain:
+    global _summarize_instance
+    if _summarize_instance is None:
+        _summarize_instance = init_summarize_instance()
+    return _summarize_instance
 
 
 async def text_summarize(docs):
-    return summarize_instance.run(docs)
+    return await get_summarize_instance().arun(docs)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from commons.metrics import get_hit_miss_counter
+from config.config import get_settings, on_settings_reload
+
+EMBEDDING_CACHE_DIR = "./db/embedding_cache"
+INGESTED_FILES_DIR = "./db/ingested_files"
+
+embedding_cache_counter = get_hit_miss_counter("embedding_cache")
+
+_embeddings: Optional["CachedEmbeddings"] = None
+
+
+def content_hash(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embedding model.
+
+    Vectors are stored under sha256(model, text), misses are de-duplicated
+    and sent to the model in `batch_size` batches, `max_concurrency` at a time.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        store: LocalFileStore,
+        batch_size: int = 500,
+        max_concurrency: int = 4,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_hash(text, self.model) for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        for key, value in zip(keys, self.store.mget(keys)):
+            if value is not None:
+                vectors[key] = array("d", value).tolist()
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        embedding_cache_counter.hit(len(texts) - len(missing))
+        embedding_cache_counter.miss(len(missing))
+        if missing:
+            missing_keys = list(missing)
+            batches = [
+                missing_keys[i : i + self.batch_size]
+                for i in range(0, len(missing_keys), self.batch_size)
+            ]
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                results = executor.map(
+                    lambda batch: self.embeddings.embed_documents(
+                        [missing[key] for key in batch]
+                    ),
+                    batches,
+                )
+                for batch, batch_vectors in zip(batches, results):
+                    vectors.update(zip(batch, batch_vectors))
+                    self.store.mset(
+                        [
+                            (key, array("d", vector).tobytes())
+                            for key, vector in zip(batch, batch_vectors)
+                        ]
+                    )
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # user questions aren't persisted, the store would grow with every one;
+        # repeated questions are answered by the semantic cache instead
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+def get_embeddings() -> Embeddings:
+    # created on first use, one client (and connection pool) for all requests
+    global _embeddings
+    if _embeddings is None:
+        settings = get_settings()
+        embeddings = OpenAIEmbeddings()
+        _embeddings = CachedEmbeddings(
+            embeddings,
+            embeddings.model,
+            LocalFileStore(EMBEDDING_CACHE_DIR),
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+        )
+    return _embeddings
+
+
+@on_settings_reload
+def _reset_embeddings(settings):
+    # rebuilt with the new batch size and concurrency on next use
+    global _embeddings
+    _embeddings = None
+
+
+_ingested_files = LocalFileStore(INGESTED_FILES_DIR)
+
+
+def get_ingested_file(file_hash: str) -> Optional[Dict]:
+    """
+    summary of a pdf already ingested with the same content hash
+    """
+    value = _ingested_files.mget([file_hash])[0]
+    return json.loads(value) if value is not None else None
+
+
+def set_ingested_file(file_hash: str, data: Dict):
+    _ingested_files.mset([(file_hash, json.dumps(data).encode("utf-8"))])
+
+
+def delete_ingested_file(file_hash: str):
+    _ingested_files.mdelete([file_hash])
+
+
+def iter_ingested_files() -> Iterator[Tuple[str, Dict]]:
+    for file_hash in list(_ingested_files.yield_keys()):
+        ingested = get_ingested_file(file_hash)
+        if ingested is not None:
+            yield file_hash, ingested
@@ -0,0 +1,103 @@
+import json
+from typing import List, Optional
+
+from loguru import logger
+
+from commons.metrics import get_hit_miss_counter
+from config.config import get_settings
+from database.messagesdb import get_message_models, retrieve_message_rows
+from models.messages import Messages, MessagesModel
+from vendor.redis import alrange, capped_append, capped_fill, capped_fill_begin
+
+
+history_cache_counter = get_hit_miss_counter("history_cache")
+# seconds a cache fill may take between its marker and writing the list
+FILL_TIMEOUT = 30
+
+
+def _history_key(user_name: str) -> str:
+    return "user:recent-messages:" + user_name
+
+
+def _dumps(message) -> str:
+    # ctime tells apart equal texts when a fill merges concurrent appends
+    return json.dumps(
+        {"type": message.type, "text": message.text, "ctime": message.ctime}
+    )
+
+
+async def append_history(messages: List[Messages]):
+    """
+    append newly stored messages to their users' recent history
+    """
+    settings = get_settings()
+    by_user = {}
+    for message in messages:
+        by_user.setdefault(message.user_name, []).append(_dumps(message))
+    for user_name, values in by_user.items():
+        try:
+            await capped_append(
+                _history_key(user_name),
+                values,
+                settings.HISTORY_CACHE_SIZE,
+                settings.HISTORY_CACHE_EXPIRE,
+            )
+        except Exception:
+            # the cache is refilled from mongo on the next miss
+            logger.exception("append history cache error")
+
+
+async def _get_cached(user_name: str, last_n: int) -> Optional[List[MessagesModel]]:
+    values = await alrange(_history_key(user_name), -last_n, -1)
+    if not values:
+        return None
+    messages = []
+    for value in values:
+        item = json.loads(value)
+        messages.append(MessagesModel(type=item["type"], text=item["text"]))
+    return messages
+
+
+async def get_recent_history(user_name: str, last_n: int) -> List[MessagesModel]:
+    """
+    last_n messages, oldest first, from the capped redis list when it's deep
+    enough, otherwise from mongo (which also fills the list)
+    """
+    if last_n <= 0:
+        # limit(0) means no limit in mongo, never from the cache
+        return await get_message_models(user_name, last_n)
+
+    settings = get_settings()
+    cache_size = settings.HISTORY_CACHE_SIZE
+    if last_n <= cache_size:
+        try:
+            cached = await _get_cached(user_name, last_n)
+        except Exception:
+            logger.exception("read history cache error")
+            cached = None
+        if cached is not None:
+            history_cache_counter.hit()
+            return cached
+
+    history_cache_counter.miss()
+    key = _history_key(user_name)
+    try:
+        # appends flushed from now on are kept aside and merged by the fill
+        await capped_fill_begin(key, FILL_TIMEOUT)
+        filling = True
+    except Exception:
+        logger.exception("begin history cache fill error")
+        filling = False
+    rows = await retrieve_message_rows(user_name, max(last_n, cache_size))
+    rows.reverse()
+    if filling:
+        try:
+            await capped_fill(
+                key,
+                [_dumps(row) for row in rows[-cache_size:]],
+                cache_size,
+                settings.HISTORY_CACHE_EXPIRE,
+            )
+        except Exception:
+            logger.exception("fill history cache error")
+    return [MessagesModel(type=row.type, text=row.text) for row in rows[-last_n:]]
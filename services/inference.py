@@ -0,0 +1,162 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import torch
+from loguru import logger
+
+from config.config import get_settings, on_settings_reload
+from services.textmodels import model_registry
+
+
+class _Job:
+    __slots__ = ("model", "text", "max_length", "future")
+
+    def __init__(self, model: str, text: str, max_length: int):
+        self.model = model
+        self.text = text
+        self.max_length = max_length
+        self.future = Future()
+
+
+class SummarizeBatcher:
+    """
+    Dedicated inference thread for middle-out summarization.
+
+    Pending middle spans from concurrent requests are collected for up to
+    `max_wait_ms` (or until `max_batch_size` is reached), run through the
+    summarizer as one padded batch, and each request's future is resolved
+    with its own summary, so the event loop never runs `generate`.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: int = 20):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._start_thread()
+
+    def _start_thread(self):
+        # holds self._lock
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="summarize-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """
+        blocks until the running batch is done, call it off the event loop
+        """
+        with self._lock:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+        if thread:
+            self._queue.put(None)
+            thread.join(timeout)
+        # jobs left behind the sentinel (or by a thread that didn't stop in
+        # time) would otherwise wait forever
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("summarize batcher stopped"))
+
+    async def summarize(self, model: str, text: str, max_length: int) -> str:
+        job = _Job(model, text, max_length)
+        with self._lock:
+            # a request during shutdown must not bring the thread back
+            if self._stopped:
+                raise RuntimeError("summarize batcher stopped")
+            self._start_thread()
+            self._queue.put(job)
+        return await asyncio.wrap_future(job.future)
+
+    def _collect(self, first: _Job) -> Tuple[List[_Job], bool]:
+        jobs = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(jobs) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            jobs, stopping = self._collect(first)
+            # a padded batch must share model and input length
+            groups = {}
+            for job in jobs:
+                groups.setdefault((job.model, job.max_length), []).append(job)
+            for (model, max_length), group in groups.items():
+                try:
+                    self._run_batch(model, max_length, group)
+                except Exception:
+                    # never let one batch end the worker thread
+                    logger.exception("summarize batch error")
+
+    def _run_batch(self, model: str, max_length: int, jobs: List[_Job]):
+        # skip requests cancelled while queued, the rest can't be cancelled anymore
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        try:
+            summaries = self._summarize(model, max_length, [job.text for job in jobs])
+        except Exception as e:
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+        for job, summary in zip(jobs, summaries):
+            job.future.set_result(summary)
+
+    def _summarize(self, model: str, max_length: int, texts: List[str]) -> List[str]:
+        tokenizer = model_registry.get_tokenizer(model)
+        summarizer = model_registry.get_summarizer(model)
+        inputs = tokenizer(
+            ["summarize: " + text for text in texts],
+            return_tensors="pt",
+            padding=True,
+            max_length=max_length,
+            truncation=True,
+        )
+        with torch.no_grad():
+            summary_ids = summarizer.generate(
+                **inputs, num_beams=4, max_length=5, early_stopping=True
+            )
+        logger.debug(f">>>>summarize batch: size: {len(texts)}")
+        return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+
+summarize_batcher = SummarizeBatcher(
+    max_batch_size=get_settings().SUMMARIZE_BATCH_SIZE,
+    max_wait_ms=get_settings().SUMMARIZE_BATCH_WAIT_MS,
+)
+
+
+@on_settings_reload
+def _apply_batcher_settings(settings):
+    summarize_batcher.max_batch_size = settings.SUMMARIZE_BATCH_SIZE
+    summarize_batcher.max_wait_ms = settings.SUMMARIZE_BATCH_WAIT_MS
@@ -0,0 +1,218 @@
+import asyncio
+import time
+import uuid
+from typing import List, Optional
+
+from fastapi import HTTPException
+from loguru import logger
+
+from commons.costants import HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE
+from commons.enums import INGEST_JOB_STATUS
+from config.config import get_settings
+from models.api import IngestJobModel
+from services.chatpdf import (
+    delete_document,
+    document_exists,
+    expire_documents,
+    feed_data,
+)
+from services.embeddings import get_ingested_file, set_ingested_file
+from vendor.redis import ahgetall, ahset, aset_nx, refresh_claim, release_claim
+
+# seconds between attempts to claim a document another job is ingesting
+CLAIM_POLL_INTERVAL = 1
+
+
+def _job_key(job_id: str) -> str:
+    return "ingest:job:" + job_id
+
+
+def _claim_key(file_hash: str) -> str:
+    return "ingest:document:" + file_hash
+
+
+async def update_job(job_id: str, /, **fields):
+    await ahset(
+        _job_key(job_id),
+        {k: "" if v is None else v for k, v in fields.items()},
+        get_settings().INGEST_JOB_EXPIRE,
+    )
+
+
+async def get_job(job_id: str) -> Optional[IngestJobModel]:
+    """
+    job state lives in redis so any worker process can answer the status poll
+    """
+    data = await ahgetall(_job_key(job_id))
+    if not data:
+        return None
+    return IngestJobModel(
+        **{k: v for k, v in data.items() if v != ""},
+    )
+
+
+class IngestQueue:
+    """
+    Bounded background pdf ingestion.
+
+    Uploads are queued as jobs and `workers` tasks run `feed_data` for them,
+    reporting progress to the job state, the request only waits for the queueing.
+    """
+
+    def __init__(self, workers: int = 2, max_size: int = 100):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        # queue slots, taken by submit before it awaits the job state write
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_size)
+            self._tasks = [
+                asyncio.create_task(self._run()) for _ in range(self.workers)
+            ]
+            if get_settings().DOCUMENT_EXPIRE_DAYS > 0:
+                self._tasks.append(asyncio.create_task(self._expire()))
+
+    async def stop(self):
+        # running ingestions clean up their job, claim and collection on cancel
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        queue, self._tasks, self._queue, self._slots = self._queue, [], None, None
+        while queue is not None and not queue.empty():
+            job_id, _, _ = queue.get_nowait()
+            await self._fail_job(job_id, "ingest queue stopped")
+
+    async def submit(
+        self, file_path: str, file_name: str, num_bytes: int, file_hash: str
+    ) -> str:
+        self.start()
+        queue, slots = self._queue, self._slots
+        if slots.locked():
+            raise HTTPException(
+                status_code=HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE,
+                detail="too many files waiting for ingestion",
+            )
+        # a free slot is taken without yielding, no other submit gets in between
+        await slots.acquire()
+        job_id = uuid.uuid4().hex
+        try:
+            await update_job(
+                job_id,
+                job_id=job_id,
+                # the content hash is the document id used by /file_chat
+                document_id=file_hash,
+                status=INGEST_JOB_STATUS.PENDING.value,
+                file_name=file_name,
+                num_bytes=num_bytes,
+            )
+        except BaseException:
+            slots.release()
+            raise
+        queue.put_nowait((job_id, file_path, file_hash))
+        return job_id
+
+    async def _run(self):
+        queue, slots = self._queue, self._slots
+        while True:
+            job_id, file_path, file_hash = await queue.get()
+            slots.release()
+            try:
+                await self._ingest(job_id, file_path, file_hash)
+            except asyncio.CancelledError:
+                # the queue is stopping, don't leave the job running
+                await self._fail_job(job_id, "ingestion cancelled", file_hash)
+                raise
+            except Exception as e:
+                # redis or disk error around the ingestion, keep the worker alive
+                logger.exception(f"ingest job {job_id} error")
+                await self._fail_job(job_id, str(e), file_hash)
+            finally:
+                queue.task_done()
+
+    async def _fail_job(
+        self, job_id: str, error: str, file_hash: Optional[str] = None
+    ):
+        try:
+            if file_hash is not None:
+                await release_claim(_claim_key(file_hash), job_id)
+            await update_job(job_id, status=INGEST_JOB_STATUS.FAILED.value, error=error)
+        except Exception:
+            logger.exception(f"mark ingest job {job_id} failed error")
+
+    async def _expire(self):
+        # keep the vector store bounded, hourly is plenty for a days long ttl
+        while True:
+            try:
+                expired = await asyncio.to_thread(
+                    expire_documents, get_settings().DOCUMENT_EXPIRE_DAYS * 24 * 3600
+                )
+                if expired:
+                    logger.info(f"expired documents: {expired}")
+            except Exception:
+                logger.exception("expire documents error")
+            await asyncio.sleep(3600)
+
+    async def _ingest(self, job_id: str, file_path: str, file_hash: str):
+        # concurrent uploads of the same content share its collection, the
+        # first one embeds it and the others wait, then find it ingested
+        claim_key = _claim_key(file_hash)
+        claim_timeout = get_settings().INGEST_CLAIM_TIMEOUT
+        while not await aset_nx(claim_key, job_id, claim_timeout):
+            await asyncio.sleep(CLAIM_POLL_INTERVAL)
+        try:
+            await self._ingest_claimed(job_id, file_path, file_hash, claim_timeout)
+        finally:
+            await release_claim(claim_key, job_id)
+
+    async def _ingest_claimed(
+        self, job_id: str, file_path: str, file_hash: str, claim_timeout: int
+    ):
+        fields = {}
+
+        async def progress(**counters):
+            fields.update(counters)
+            await refresh_claim(_claim_key(file_hash), job_id, claim_timeout)
+            await update_job(job_id, **counters)
+
+        # same content was ingested before, it's already in the vector store
+        ingested = get_ingested_file(file_hash)
+        if ingested:
+            await update_job(
+                job_id,
+                status=INGEST_JOB_STATUS.DONE.value,
+                **{k: v for k, v in ingested.items() if k != "ctime"},
+            )
+            return
+
+        await update_job(job_id, status=INGEST_JOB_STATUS.RUNNING.value)
+        created = not await asyncio.to_thread(document_exists, file_hash)
+        try:
+            summary = await feed_data(file_path, file_hash, progress)
+            set_ingested_file(
+                file_hash, {**fields, "summary": summary, "ctime": int(time.time())}
+            )
+        except BaseException as e:
+            # don't leave a half embedded document behind, cancelled or not,
+            # but never drop a collection this job didn't create
+            if created:
+                await asyncio.to_thread(delete_document, file_hash)
+            if not isinstance(e, Exception):
+                # cancelled, _run marks the job failed
+                raise
+            logger.exception(f"ingest {file_path} error")
+            await update_job(
+                job_id, status=INGEST_JOB_STATUS.FAILED.value, error=str(e)
+            )
+            return
+        await update_job(job_id, status=INGEST_JOB_STATUS.DONE.value, summary=summary)
+
+
+ingest_queue = IngestQueue(
+    workers=get_settings().INGEST_WORKERS,
+    max_size=get_settings().INGEST_QUEUE_SIZE,
+)
@@ -1,27 +1,41 @@
+import asyncio
+import json
 import time
 import traceback
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
+from bson import ObjectId
 from fastapi import HTTPException
-from httpx import AsyncClient
 from loguru import logger
 from commons.costants import (
+    HTTP_STATUS_CODE_200_OK,
+    HTTP_STATUS_CODE_400_BAD_REQUEST,
     HTTP_STATUS_CODE_401_UNAUTHORIZED,
     HTTP_STATUS_CODE_500_SERVER_ERROR,
     HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE,
 )
 from commons.enums import MIDDLE_OUT_MODE
-from commons.utils import get_current_date_str
-from config.config import Settings
-from database.messagesdb import add_message, get_message_models
-from database.userlimitsdb import deduct_userlimit, get_userlimit
+from config.config import get_settings
+from database.messagesdb import iter_messages, retrieve_messages_page
 from models.api import AdvancedChatReq, ChatReq
+from models.messages import MessagesModel, MessagesPage
 from models.userlimits import UserLimitModel
+from services.historycache import get_recent_history
+from services.inference import summarize_batcher
+from services.messagesink import message_sink
+from services.modelrouter import model_router, parse_models
+from services.quota import (
+    acquire_chat_quota,
+    get_chat_cnt_today,
+    release_chat_quota,
+)
+from services.responsecache import response_cache
+from services.textmodels import model_registry
+from vendor.openrouter import CircuitOpenError, UpstreamClient, iter_chat_deltas
 from vendor.redis import can_pass_slide_window, set, get, incr, expire
 from transformers import (
     pipeline,
     BertTokenizer,
-    T5Tokenizer,
-    T5ForConditionalGeneration,
 )
 
 
@@ -35,33 +49,57 @@ async def ai_chat(client, req: ChatReq):
         req.message,
         req.middle_out_mode,
         req.max_tokens,
-        Settings().DEFAULT_PROMPT,
+        get_settings().DEFAULT_PROMPT,
+        use_cache=True,
+    )
+
+
+async def ai_chat_stream(client, req: ChatReq) -> AsyncIterator[str]:
+    return await handle_ai_chat_stream(
+        client,
+        req.user_name,
+        req.message,
+        req.middle_out_mode,
+        req.max_tokens,
+        get_settings().DEFAULT_PROMPT,
     )
 
 
 async def ai_chat_advanced(client, req: AdvancedChatReq):
     prompt = req.prompt
     if not prompt:
-        prompt = Settings().DEFAULT_ADVANCED_PROMPT
+        prompt = get_settings().DEFAULT_ADVANCED_PROMPT
     return await handle_ai_chat(
-        client, req.user_name, req.message, req.middle_out_mode, req.max_tokens, prompt
+        client,
+        req.user_name,
+        req.message,
+        req.middle_out_mode,
+        req.max_tokens,
+        prompt,
+        # custom prompts rarely repeat, cache only when configured
+        use_cache=get_settings().CHAT_RESPONSE_CACHE_ADVANCED,
     )
 
 
-async def handle_ai_chat(
-    client: AsyncClient,
+async def _begin_chat(
+    settings,
     user_name: str,
     message: str,
     middle_out_mode: str,
     max_tokens: int,
     prompt: str,
-):
+) -> Tuple[Optional[asyncio.Future], List[Dict], str]:
+    """
+    check the user limits, take one chat from today's quota and store the
+    user message, returns its write future, the upstream chat messages and
+    the quota date to release the chat against
+    """
     # check user limit by per 30second (一个用户每 30 秒最多发送 3 条信息)
-    limit_rate_time_period = int(Settings().CHAT_LIMIT_RATE_TIME_PERIOD)
-    limit_rate_count = int(Settings().CHAT_LIMIT_RATE_COUNT)
+    limit_rate_time_period = settings.CHAT_LIMIT_RATE_TIME_PERIOD
+    limit_rate_count = settings.CHAT_LIMIT_RATE_COUNT
 
     userlimit_key_30s = "user:message-limit:per-30s:" + user_name
-    can_pass = can_pass_slide_window(
+    can_pass = await can_pass_slide_window(
         userlimit_key_30s, limit_rate_time_period, limit_rate_count
     )
     if not can_pass:
@@ -71,52 +109,108 @@ async def handle_ai_chat(
         )
 
     # check user limit by per day (一个用户一天最多发送 20 条信息)
-    day_limit_count = int(Settings().CHAT_LIMIT_ONE_DAY_COUNT)
-    userlimit = await get_userlimit(user_name, get_current_date_str())
-    if userlimit and userlimit.chat_cnt > day_limit_count:
+    day_limit_count = settings.CHAT_LIMIT_ONE_DAY_COUNT
+    quota_date = await acquire_chat_quota(user_name, day_limit_count)
+    if quota_date is None:
         raise HTTPException(
             status_code=HTTP_STATUS_CODE_401_UNAUTHORIZED,
             detail="exceed user limit per day",
         )
 
-    # store user message
-    ai_message = Messages(
+    # store user message, written by the message sink in the background
+    user_message = Messages(
         user_name=user_name,
         type="user",
         text=message,
         ctime=int(time.time() * 1000),
         mtime=int(time.time() * 1000),
     )
-    await add_message(ai_message)
+    user_message_written = message_sink.put(user_message)
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": "Bearer " + Settings().OPENROUTER_API_KEY,
-    }
     # middle out user message
     logger.debug(f">>>>origin text: {message}")
-    handle_message = handle_middle_out_text(message, middle_out_mode, max_tokens)
+    handle_message = await handle_middle_out_text(message, middle_out_mode, max_tokens)
     logger.debug(f">>>>current text: {handle_message}")
-    data = {
-        "model": Settings().CHAT_MODEL,
-        "messages": [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": handle_message},
-        ],
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": handle_message},
+    ]
+    return user_message_written, messages, quota_date
+
+
+def _chat_headers(settings) -> Dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + settings.OPENROUTER_API_KEY,
     }
-    try:
-        timeout_seconds = int(Settings().CHAT_REQUEST_TIME_OUT)
-        logger.debug(f">>>>request: timeout: {timeout_seconds}, data: {data}")
+
+
+def _configure_router(settings):
+    model_router.configure(
+        settings.CHAT_ROUTER_WINDOW_SECONDS,
+        settings.CHAT_ROUTER_MIN_SAMPLES,
+        settings.CHAT_ROUTER_MAX_ERROR_RATE,
+    )
+
+
+async def handle_ai_chat(
+    client: UpstreamClient,
+    user_name: str,
+    message: str,
+    middle_out_mode: str,
+    max_tokens: int,
+    prompt: str,
+    use_cache: bool = False,
+):
+    # one settings snapshot for the whole request
+    settings = get_settings()
+    user_message_written, messages, quota_date = await _begin_chat(
+        settings, user_name, message, middle_out_mode, max_tokens, prompt
+    )
+    headers = _chat_headers(settings)
+    models = parse_models(settings.CHAT_MODELS, settings.CHAT_MODEL)
+
+    async def request_chat(model: str):
+        data = {"model": model, "messages": messages}
+        logger.debug(f">>>>request: data: {data}")
+        # timeouts, retries and the circuit breaker live in the upstream client
         response = await client.post(
-            Settings().OPENROUTER_API_URL,
+            settings.OPENROUTER_API_URL,
             headers=headers,
             json=data,
-            timeout=timeout_seconds,
+            breaker_key=model,
         )
         logger.debug(f">>>>response: {response.json()}")
-        chat_resp = response.json()["choices"][0]["message"]["content"]
+        return response.json()["choices"][0]["message"]["content"]
+
+    _configure_router(settings)
+
+    async def route_chat():
+        # fastest healthy model first, the others as fallback / hedge
+        return await model_router.call(
+            models, request_chat, settings.CHAT_HEDGE_AFTER_MS
+        )
+
+    try:
+        if use_cache and settings.CHAT_RESPONSE_CACHE_TTL > 0:
+            # identical payloads share one upstream call and its answer,
+            # whichever model of the configured list ends up answering
+            payload = {"models": [name for name, _ in models], "messages": messages}
+            chat_resp = await response_cache.get_or_call(
+                payload, route_chat, settings.CHAT_RESPONSE_CACHE_TTL
+            )
+        else:
+            chat_resp = await route_chat()
+    except CircuitOpenError:
+        logger.warning("openrouter circuits open for all models, fail fast")
+        await release_chat_quota(user_name, quota_date)
+        raise HTTPException(
+            status_code=HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE,
+            detail="openrouter service unavailable",
+        )
     except:
         traceback.print_exc()
+        await release_chat_quota(user_name, quota_date)
         raise HTTPException(
             status_code=HTTP_STATUS_CODE_500_SERVICE_UNAVAILABLE,
             detail="request openrouter service error",
@@ -130,58 +224,199 @@ async def handle_ai_chat(
         ctime=int(time.time() * 1000),
         mtime=int(time.time() * 1000),
     )
-    await add_message(ai_message)
+    ai_message_written = message_sink.put(ai_message)
+    # ack mode waits for both messages, async mode returns right away
+    await message_sink.wait(user_message_written, ai_message_written)
 
-    await deduct_userlimit(user_name, get_current_date_str())
     return {"response": chat_resp}
 
 
+# fire and forget work of streams whose client went away
+# (`set` here is the redis helper), keeps the tasks referenced until done
+_background_tasks: Dict[asyncio.Future, None] = {}
+
+
+def _run_in_background(coro):
+    task = asyncio.ensure_future(coro)
+    _background_tasks[task] = None
+    task.add_done_callback(lambda done: _background_tasks.pop(done, None))
+
+
+def _sse_event(data: Dict, event: Optional[str] = None) -> str:
+    frame = f"event: {event}\n" if event else ""
+    return frame + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+
+
+async def handle_ai_chat_stream(
+    client: UpstreamClient,
+    user_name: str,
+    message: str,
+    middle_out_mode: str,
+    max_tokens: int,
+    prompt: str,
+) -> AsyncIterator[str]:
+    """
+    same checks as handle_ai_chat (raised before anything is sent), then an
+    iterator of server-sent events relaying the answer as it is generated
+    """
+    settings = get_settings()
+    user_message_written, messages, quota_date = await _begin_chat(
+        settings, user_name, message, middle_out_mode, max_tokens, prompt
+    )
+    headers = _chat_headers(settings)
+    _configure_router(settings)
+    ranked = model_router.rank(parse_models(settings.CHAT_MODELS, settings.CHAT_MODEL))
+
+    def store_answer(parts: List[str]) -> Optional[asyncio.Future]:
+        ai_message = Messages(
+            user_name=user_name,
+            type="ai",
+            # the deltas are the only copy of the answer kept in memory
+            text="".join(parts),
+            ctime=int(time.time() * 1000),
+            mtime=int(time.time() * 1000),
+        )
+        return message_sink.put(ai_message)
+
+    async def relay() -> AsyncIterator[str]:
+        parts: List[str] = []
+        stored = False
+        error: Optional[Exception] = None
+        try:
+            for model in ranked:
+                start = time.monotonic()
+                data = {"model": model, "messages": messages, "stream": True}
+                logger.debug(f">>>>stream request: data: {data}")
+                try:
+                    async with client.stream(
+                        settings.OPENROUTER_API_URL,
+                        headers=headers,
+                        json=data,
+                        breaker_key=model,
+                    ) as response:
+                        if response.status_code != HTTP_STATUS_CODE_200_OK:
+                            raise ValueError(f"upstream status {response.status_code}")
+                        async for content in iter_chat_deltas(response):
+                            parts.append(content)
+                            yield _sse_event({"content": content})
+                except CircuitOpenError as e:
+                    # this model's circuit is open, nothing was sent yet
+                    error = e
+                    continue
+                except Exception as e:
+                    error = e
+                    model_router.record(model, time.monotonic() - start, False)
+                    if parts:
+                        # the client already has part of this answer
+                        raise
+                    logger.warning(f"chat model {model} failed, try the next one: {e!r}")
+                    continue
+                model_router.record(model, time.monotonic() - start, True)
+                break
+            else:
+                raise error or ValueError("no chat model configured")
+
+            ai_message_written = store_answer(parts)
+            stored = True
+            # ack mode waits for both messages before telling the client it's done
+            await message_sink.wait(user_message_written, ai_message_written)
+            yield "data: [DONE]\n\n"
+        except CircuitOpenError:
+            logger.warning("openrouter circuits open for all models, fail fast")
+            yield _sse_event({"detail": "openrouter service unavailable"}, "error")
+        except Exception:
+            traceback.print_exc()
+            yield _sse_event({"detail": "request openrouter service error"}, "error")
+        finally:
+            # runs on completion, error and client disconnect alike
+            if not stored and parts:
+                # keep the partial answer the client has seen
+                store_answer(parts)
+            elif not stored:
+                # nothing was delivered, give the chat back
+                _run_in_background(release_chat_quota(user_name, quota_date))
+
+    return relay()
+
+
 async def get_chat_history(user_name: str, last_n: int):
-    return await get_message_models(user_name, last_n)
+    return await get_recent_history(user_name, last_n)
+
+
+def _encode_cursor(row: dict) -> str:
+    return f"{row['ctime']}_{row['_id']}"
+
+
+def _decode_cursor(cursor: str):
+    try:
+        ctime, id = cursor.split("_", 1)
+        return int(ctime), ObjectId(id)
+    except Exception:
+        raise HTTPException(
+            status_code=HTTP_STATUS_CODE_400_BAD_REQUEST, detail="invalid cursor"
+        )
+
+
+async def get_chat_history_page(
+    user_name: str, limit: int, cursor: Optional[str] = None
+) -> MessagesPage:
+    before = _decode_cursor(cursor) if cursor else None
+    rows = await retrieve_messages_page(user_name, limit, before)
+    next_cursor = _encode_cursor(rows[-1]) if len(rows) == limit else None
+    return MessagesPage(
+        messages=[
+            MessagesModel(type=row["type"], text=row["text"]) for row in reversed(rows)
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+async def export_chat_history(user_name: str) -> AsyncIterator[str]:
+    """
+    NDJSON lines of every message of the user, oldest first
+    """
+    async for row in iter_messages(user_name):
+        yield json.dumps(row, ensure_ascii=False) + "\n"
 
 
 async def get_chat_status_today_by(user_name: str):
-    day_limit_count = int(Settings().CHAT_LIMIT_ONE_DAY_COUNT)
-    userlimit = await get_userlimit(user_name, get_current_date_str())
-    if userlimit:
-        return UserLimitModel(user_name=user_name, chat_cnt=userlimit.chat_cnt)
+    day_limit_count = get_settings().CHAT_LIMIT_ONE_DAY_COUNT
+    chat_cnt = await get_chat_cnt_today(user_name)
+    if chat_cnt is not None:
+        return UserLimitModel(user_name=user_name, chat_cnt=chat_cnt)
     return UserLimitModel(user_name=user_name, chat_cnt=day_limit_count)
 
 
-def handle_middle_out_text(
-    text: str, middle_out_mode: MIDDLE_OUT_MODE, max_tokens: int
+async def handle_middle_out_text(
+    text: str, middle_out_mode: MIDDLE_OUT_MODE, max_tokens: Optional[int]
 ):
+    if max_tokens is None:
+        max_tokens = get_settings().TEXT_HANDLE_MAX_TOKENS
+    if max_tokens is None:
+        # no limit configured, nothing to compress to
+        return text
     if middle_out_mode == MIDDLE_OUT_MODE.SUMMARITION:
-        text = compress_text_with_summarition(
-            text, max_tokens, Settings().TEXT_HANDLE_MODEL
+        text = await compress_text_with_summarition(
+            text, max_tokens, get_settings().TEXT_HANDLE_MODEL
         )
     elif middle_out_mode == MIDDLE_OUT_MODE.TRIM:
-        text = compress_text(text, max_tokens, Settings().TEXT_HANDLE_MODEL)
+        text = compress_text(text, max_tokens, get_settings().TEXT_HANDLE_MODEL)
     return text
 
 
-def compress_text_with_summarition(text: str, max_length: int, model: str):
-    tokenizer = T5Tokenizer.from_pretrained(model)
+async def compress_text_with_summarition(text: str, max_length: int, model: str):
+    tokenizer = model_registry.get_tokenizer(model)
     tokens = tokenizer.tokenize(text)
     if len(tokens) > max_length:
-        summarizer = T5ForConditionalGeneration.from_pretrained(model)
-
         start_len = max_length // 4
         end_len = max_length - start_len
         middle_text = tokenizer.convert_tokens_to_string(
             tokens[start_len - 10 : end_len + 10]
         )
-        inputs = tokenizer.encode(
-            "summarize: " + middle_text,
-            return_tensors="pt",
-            max_length=max_length // 2,
-            truncation=True,
-        )
-
-        summary_ids = summarizer.generate(
-            inputs, num_beams=4, max_length=5, early_stopping=True
+        # generate runs batched on the inference thread, not on the event loop
+        summary = await summarize_batcher.summarize(
+            model, middle_text, max_length // 2
         )
-        summary = tokenizer.decode(summary_ids[0])
 
         # 保持开头和结尾的内容不变，将中间的一半内容压缩
         tokens = tokens[:start_len] + tokenizer.tokenize(summary) + tokens[-end_len:]
@@ -215,7 +450,7 @@ def compress_text_with_summarition_old(text: str, max_length: int, model: str):
 
 
 def compress_text(text: str, max_length: int, model: str):
-    tokenizer = T5Tokenizer.from_pretrained(model)
+    tokenizer = model_registry.get_tokenizer(model)
     tokens = tokenizer.tokenize(text)
 
     if len(tokens) > max_length:
@@ -0,0 +1,107 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from commons.enums import MESSAGE_WRITE_MODE
+from config.config import get_settings, on_settings_reload
+from database.messagesdb import add_messages
+from models.messages import Messages
+from services.activity import record_activity
+from services.historycache import append_history
+
+
+class MessageSink:
+    """
+    Write-behind buffer for chat messages.
+
+    Messages are flushed with one `insert_many` when `max_batch_size` is
+    reached or `interval_ms` after the first pending one. In ack mode `put`
+    returns a future resolved once the batch holding the message is written,
+    in async mode it returns None and write errors are only logged.
+    """
+
+    def __init__(
+        self,
+        write_mode: MESSAGE_WRITE_MODE = MESSAGE_WRITE_MODE.ACK,
+        max_batch_size: int = 100,
+        interval_ms: int = 50,
+    ):
+        self.write_mode = write_mode
+        self.max_batch_size = max_batch_size
+        self.interval_ms = interval_ms
+        self._buffer: List[Tuple[Messages, Optional[asyncio.Future]]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def put(self, message: Messages) -> Optional[asyncio.Future]:
+        future = None
+        if self.write_mode == MESSAGE_WRITE_MODE.ACK:
+            future = asyncio.get_running_loop().create_future()
+        self._buffer.append((message, future))
+        self.start()
+        self._wakeup.set()
+        return future
+
+    async def wait(self, *futures: Optional[asyncio.Future]):
+        futures = [future for future in futures if future is not None]
+        if futures:
+            await asyncio.gather(*futures)
+
+    async def flush(self):
+        while self._buffer:
+            batch = self._buffer[: self.max_batch_size]
+            del self._buffer[: self.max_batch_size]
+            try:
+                await add_messages([message for message, _ in batch])
+            except Exception as e:
+                logger.exception(f"flush {len(batch)} messages error")
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                continue
+            messages = [message for message, _ in batch]
+            await append_history(messages)
+            await record_activity(messages)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            # give concurrent requests a chance to join the batch
+            if not self._stopping and len(self._buffer) < self.max_batch_size:
+                await asyncio.sleep(self.interval_ms / 1000)
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # let the running flush finish instead of cancelling it mid insert
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+message_sink = MessageSink(
+    write_mode=MESSAGE_WRITE_MODE(get_settings().MESSAGE_WRITE_MODE),
+    max_batch_size=get_settings().MESSAGE_FLUSH_SIZE,
+    interval_ms=get_settings().MESSAGE_FLUSH_INTERVAL_MS,
+)
+
+
+@on_settings_reload
+def _apply_message_sink_settings(settings):
+    message_sink.write_mode = MESSAGE_WRITE_MODE(settings.MESSAGE_WRITE_MODE)
+    message_sink.max_batch_size = settings.MESSAGE_FLUSH_SIZE
+    message_sink.interval_ms = settings.MESSAGE_FLUSH_INTERVAL_MS
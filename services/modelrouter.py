@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from vendor.openrouter import CircuitOpenError
+
+
+def parse_models(models: str, default: Optional[str] = None) -> List[Tuple[str, float]]:
+    """
+    "model-a:3, model-b, model-c:0.5" -> [("model-a", 3), ("model-b", 1), ("model-c", 0.5)]
+    an empty list falls back to the single default model
+    """
+    parsed = []
+    for item in (models or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, weight = item.rpartition(":")
+        # model ids may contain ":" themselves (e.g. "vendor/model:free")
+        try:
+            parsed.append((name.strip(), float(weight)) if sep else (item, 1.0))
+        except ValueError:
+            parsed.append((item, 1.0))
+    if not parsed and default:
+        parsed.append((default, 1.0))
+    return parsed
+
+
+class ModelStats:
+    """
+    rolling (timestamp, latency, ok) samples of one model
+    """
+
+    def __init__(self):
+        self.samples: Deque[Tuple[float, float, bool]] = deque()
+
+    def add(self, latency: float, ok: bool, now: float):
+        self.samples.append((now, latency, ok))
+
+    def trim(self, window: float, now: float):
+        while self.samples and now - self.samples[0][0] > window:
+            self.samples.popleft()
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0
+        return sum(1 for _, _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency(self) -> float:
+        # mean of successful calls, a model without any is tried as if it was free
+        latencies = [latency for _, latency, ok in self.samples if ok]
+        return sum(latencies) / len(latencies) if latencies else 0
+
+
+class ModelRouter:
+    """
+    Picks the upstream chat model for each request.
+
+    Healthy models are ranked by rolling mean latency divided by their
+    weight, unhealthy ones (error rate over `max_error_rate`) are kept
+    at the end as a last resort in configured order. Samples older than
+    `window` seconds are dropped so an unhealthy model recovers by itself.
+    """
+
+    def __init__(
+        self,
+        window: float = 300,
+        min_samples: int = 5,
+        max_error_rate: float = 0.5,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, window: float, min_samples: int, max_error_rate: float):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+
+    def _get_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats.setdefault(model, ModelStats())
+        return stats
+
+    def record(self, model: str, latency: float, ok: bool):
+        now = time.monotonic()
+        with self._lock:
+            stats = self._get_stats(model)
+            stats.add(latency, ok, now)
+            stats.trim(self.window, now)
+
+    def is_healthy(self, model: str) -> bool:
+        with self._lock:
+            stats = self._get_stats(model)
+            stats.trim(self.window, time.monotonic())
+            if len(stats.samples) < self.min_samples:
+                return True
+            return stats.error_rate() <= self.max_error_rate
+
+    def rank(self, models: List[Tuple[str, float]]) -> List[str]:
+        healthy, unhealthy = [], []
+        for index, (name, weight) in enumerate(models):
+            if self.is_healthy(name):
+                with self._lock:
+                    score = self._get_stats(name).latency() / max(weight, 1e-6)
+                # configured order breaks ties, e.g. before any samples exist
+                healthy.append((score, index, name))
+            else:
+                unhealthy.append(name)
+        return [name for _, _, name in sorted(healthy)] + unhealthy
+
+    async def _timed(self, call: Callable[[str], Awaitable[str]], model: str) -> str:
+        start = time.monotonic()
+        try:
+            answer = await call(model)
+        except (asyncio.CancelledError, CircuitOpenError):
+            # lost a hedge race / failed fast without a call, nothing to record
+            raise
+        except Exception:
+            self.record(model, time.monotonic() - start, False)
+            raise
+        self.record(model, time.monotonic() - start, True)
+        return answer
+
+    async def _hedged(
+        self,
+        call: Callable[[str], Awaitable[str]],
+        primary: str,
+        backup: str,
+        hedge_after: float,
+    ) -> str:
+        pending = {asyncio.ensure_future(self._timed(call, primary))}
+        backup_started = False
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None if backup_started else hedge_after
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    # a failed (or open circuit) backup doesn't stop a pending primary
+                    error = task.exception()
+                if not backup_started:
+                    # primary is slow or already failed, race the backup
+                    logger.debug(f"hedge chat request {primary} -> {backup}")
+                    pending.add(asyncio.ensure_future(self._timed(call, backup)))
+                    backup_started = True
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call(
+        self,
+        models: List[Tuple[str, float]],
+        call: Callable[[str], Awaitable[str]],
+        hedge_after_ms: int = 0,
+    ) -> str:
+        """
+        call(model) with the best ranked model, falling back to the next
+        ones on error; with `hedge_after_ms` the next model is also raced
+        once the current one is slower than that. Every model has its own
+        circuit breaker upstream, an open one is skipped like a failure.
+        """
+        ranked = self.rank(models)
+        if not ranked:
+            raise ValueError("no chat model configured")
+        error: Optional[BaseException] = None
+        index = 0
+        while index < len(ranked):
+            try:
+                if hedge_after_ms > 0 and index + 1 < len(ranked):
+                    index += 2
+                    return await self._hedged(
+                        call, ranked[index - 2], ranked[index - 1], hedge_after_ms / 1000
+                    )
+                index += 1
+                return await self._timed(call, ranked[index - 1])
+            except Exception as e:
+                logger.warning(f"chat model failed, try the next one: {e!r}")
+                error = e
+        raise error
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                stats.trim(self.window, now)
+                result[name] = {
+                    "samples": len(stats.samples),
+                    "latency": stats.latency(),
+                    "error_rate": stats.error_rate(),
+                }
+            return result
+
+
+model_router = ModelRouter()
@@ -0,0 +1,73 @@
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from config.config import get_settings
+
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # forked children inherit the parent's held locks (summarizer threads)
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=get_settings().PDF_EXTRACT_WORKERS or None,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+
+def count_pages(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    text of pages [start, end), runs in the pdf process pool
+    """
+    reader = PdfReader(file_path)
+    return [(i, reader.pages[i].extract_text()) for i in range(start, end)]
+
+
+async def iter_pages(file_path: str) -> AsyncIterator[Document]:
+    """
+    pages in order, parsed in page ranges by the process pool, at most
+    `PDF_EXTRACT_WORKERS * 2` ranges are held in memory at once
+    """
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    pool = get_pdf_pool()
+    num_pages = await loop.run_in_executor(pool, count_pages, file_path)
+    ranges = deque(
+        (start, min(start + settings.PDF_EXTRACT_PAGES_PER_TASK, num_pages))
+        for start in range(0, num_pages, settings.PDF_EXTRACT_PAGES_PER_TASK)
+    )
+    max_in_flight = (settings.PDF_EXTRACT_WORKERS or os.cpu_count() or 1) * 2
+
+    in_flight = deque()
+    while ranges or in_flight:
+        while ranges and len(in_flight) < max_in_flight:
+            start, end = ranges.popleft()
+            in_flight.append(
+                loop.run_in_executor(pool, extract_page_range, file_path, start, end)
+            )
+        for page, text in await in_flight.popleft():
+            # same metadata as PyPDFLoader
+            yield Document(
+                page_content=text, metadata={"source": file_path, "page": page}
+            )
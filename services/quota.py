@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+from commons.utils import get_current_date_str, get_next_midnight_ts
+from config.config import get_settings, on_settings_reload
+from database.userlimitsdb import bulk_set_userlimits, get_userlimit
+from vendor.redis import amget, incr_below_limit, incr_expire_at
+
+
+def _quota_key(user_name: str, use_date: str) -> str:
+    return f"user:message-limit:per-day:{use_date}:{user_name}"
+
+
+class QuotaFlusher:
+    """
+    Write-behind of the Redis daily counters to `UserLimits`.
+
+    Counters touched since the last flush are re-read from Redis and upserted
+    in one bulk write every `interval` seconds, and once more on shutdown.
+    """
+
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self._dirty: Dict[Tuple[str, str], int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def mark(self, user_name: str, use_date: str, chat_cnt: int):
+        self._dirty[(user_name, use_date)] = chat_cnt
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            # latest value wins over what this worker saw, counters are shared
+            values = await amget([_quota_key(*item) for item in dirty])
+            for item, value in zip(dirty, values):
+                if value is not None:
+                    dirty[item] = int(value)
+            await bulk_set_userlimits(dirty)
+        except Exception:
+            logger.exception("flush userlimits error")
+            for item, chat_cnt in dirty.items():
+                self._dirty.setdefault(item, chat_cnt)
+
+    async def _run(self):
+        while not self._stopping:
+            # stop wakes the wait up early for a last flush
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # let the running flush finish, a cancel would drop its counters
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+quota_flusher = QuotaFlusher(get_settings().CHAT_LIMIT_FLUSH_INTERVAL)
+
+
+@on_settings_reload
+def _apply_quota_flusher_settings(settings):
+    quota_flusher.interval = settings.CHAT_LIMIT_FLUSH_INTERVAL
+
+
+def _quota_expire_at(use_date: str) -> int:
+    # the counter of a day lives until the midnight ending that day
+    return get_next_midnight_ts(datetime.strptime(use_date, "%Y-%m-%d"))
+
+
+async def _seed_chat_cnt(user_name: str, use_date: str) -> int:
+    # first message of the day on this redis, seed from mongo history
+    userlimit = await get_userlimit(user_name, use_date)
+    return userlimit.chat_cnt if userlimit else 0
+
+
+async def acquire_chat_quota(user_name: str, day_limit_count: int) -> Optional[str]:
+    """
+    atomically take one chat from today's quota, returns the quota date to hand
+    back to release_chat_quota, None if it's used up
+    """
+    use_date = get_current_date_str()
+    key = _quota_key(user_name, use_date)
+    expire_at = _quota_expire_at(use_date)
+    result = await incr_below_limit(key, day_limit_count, expire_at)
+    if result is None:
+        seed = await _seed_chat_cnt(user_name, use_date)
+        result = await incr_below_limit(key, day_limit_count, expire_at, seed=seed)
+    taken, chat_cnt = result
+    if not taken:
+        return None
+    quota_flusher.mark(user_name, use_date, chat_cnt)
+    return use_date
+
+
+async def release_chat_quota(user_name: str, use_date: str):
+    """
+    give back a chat taken by acquire_chat_quota, e.g. the upstream call failed
+
+    :param use_date: returned by acquire_chat_quota, a chat taken before
+        midnight goes back to that day's counter
+    """
+    key = _quota_key(user_name, use_date)
+    expire_at = _quota_expire_at(use_date)
+    chat_cnt = await incr_expire_at(key, -1, expire_at)
+    if chat_cnt is None:
+        seed = await _seed_chat_cnt(user_name, use_date)
+        chat_cnt = await incr_expire_at(key, -1, expire_at, seed=seed)
+    quota_flusher.mark(user_name, use_date, chat_cnt)
+
+
+async def get_chat_cnt_today(user_name: str) -> Optional[int]:
+    use_date = get_current_date_str()
+    values = await amget([_quota_key(user_name, use_date)])
+    if values[0] is not None:
+        return int(values[0])
+    userlimit = await get_userlimit(user_name, use_date)
+    if userlimit:
+        return userlimit.chat_cnt
+    return None
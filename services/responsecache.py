@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict
+
+from loguru import logger
+
+from commons.metrics import get_hit_miss_counter
+from vendor.redis import aget, aset
+
+response_cache_counter = get_hit_miss_counter("chat_response_cache")
+
+
+def payload_key(payload: Dict) -> str:
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return "chat:response:" + hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of upstream chat answers keyed by the request payload.
+
+    Concurrent identical requests in this worker share a single upstream
+    call (single flight), answers are kept in redis for `ttl` seconds.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def _call_and_store(self, key: str, call: Callable[[], Awaitable[str]], ttl):
+        try:
+            answer = await call()
+            try:
+                await aset(key, answer, ttl)
+            except Exception:
+                logger.exception("write response cache error")
+            return answer
+        finally:
+            self._in_flight.pop(key, None)
+
+    async def get_or_call(
+        self, payload: Dict, call: Callable[[], Awaitable[str]], ttl: int
+    ) -> str:
+        key = payload_key(payload)
+        try:
+            cached = await aget(key)
+        except Exception:
+            logger.exception("read response cache error")
+            cached = None
+        if cached is not None:
+            response_cache_counter.hit()
+            return cached
+
+        task = self._in_flight.get(key)
+        if task is None:
+            response_cache_counter.miss()
+            # a task of its own, one caller going away doesn't cancel the others
+            task = asyncio.ensure_future(self._call_and_store(key, call, ttl))
+            self._in_flight[key] = task
+        else:
+            response_cache_counter.hit()
+        return await asyncio.shield(task)
+
+
+response_cache = ResponseCache()
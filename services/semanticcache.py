@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from commons.metrics import get_hit_miss_counter
+from config.config import get_settings, on_settings_reload
+
+semantic_cache_counter = get_hit_miss_counter("file_chat_semantic_cache")
+
+
+class _Entry:
+    __slots__ = ("document_id", "question", "vector", "answer", "expires_at")
+
+    def __init__(self, document_id, question, vector, answer, expires_at):
+        self.document_id = document_id
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.expires_at = expires_at
+
+
+class SemanticCache:
+    """
+    Answers of previous questions per document, looked up by cosine
+    similarity of the question embedding.
+
+    Entries expire after `ttl` seconds, the least recently used are evicted
+    past `max_entries`, and a document's entries can be dropped at once.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: int = 3600, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_document: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        keys = self._by_document.get(entry.document_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_document[entry.document_id]
+
+    def get(self, document_id: str, vector: List[float]) -> Optional[str]:
+        now = time.time()
+        query = self._normalize(vector)
+        with self._lock:
+            keys = list(self._by_document.get(document_id, ()))
+            for key in keys:
+                if self._entries[key].expires_at <= now:
+                    self._remove(key)
+            keys = [key for key in keys if key in self._entries]
+            if keys:
+                matrix = np.stack([self._entries[key].vector for key in keys])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    semantic_cache_counter.hit()
+                    return self._entries[keys[best]].answer
+        semantic_cache_counter.miss()
+        return None
+
+    def put(self, document_id: str, question: str, vector: List[float], answer: str):
+        key = uuid.uuid4().hex
+        expires_at = time.time() + self.ttl
+        entry = _Entry(document_id, question, self._normalize(vector), answer, expires_at)
+        with self._lock:
+            self._entries[key] = entry
+            self._by_document.setdefault(document_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, document_id: str):
+        with self._lock:
+            for key in list(self._by_document.get(document_id, ())):
+                self._remove(key)
+
+
+semantic_cache = SemanticCache(
+    max_entries=get_settings().SEMANTIC_CACHE_SIZE,
+    ttl=get_settings().SEMANTIC_CACHE_TTL,
+    threshold=get_settings().SEMANTIC_CACHE_THRESHOLD,
+)
+
+
+@on_settings_reload
+def _apply_semantic_cache_settings(settings):
+    semantic_cache.max_entries = settings.SEMANTIC_CACHE_SIZE
+    semantic_cache.ttl = settings.SEMANTIC_CACHE_TTL
+    semantic_cache.threshold = settings.SEMANTIC_CACHE_THRESHOLD
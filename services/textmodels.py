@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from loguru import logger
+from transformers import T5ForConditionalGeneration, T5Tokenizer
+
+from config.config import get_settings, on_settings_reload
+
+
+def _estimate_nbytes(obj: Any) -> int:
+    # tokenizers are small compared to model weights, count only parameters
+    if hasattr(obj, "parameters"):
+        return sum(p.numel() * p.element_size() for p in obj.parameters())
+    return 0
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of tokenizers / models used by middle-out compression.
+
+    Each (kind, model name) is loaded once per worker and shared by all requests,
+    least recently used entries are evicted when `max_entries` or
+    `max_memory_mb` is exceeded.
+    """
+
+    def __init__(self, max_entries: int = 4, max_memory_mb: int = 0):
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: dict = {}
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_or_load(self, kind: str, name: str, loader: Callable[[str], Any]):
+        key = (kind, name)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        # only one thread loads a given model, others wait for it
+        with self._key_lock(key):
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+            logger.debug(f">>>>load {kind}: {name}")
+            obj = loader(name)
+            with self._lock:
+                self._entries[key] = (obj, _estimate_nbytes(obj))
+                self._evict()
+            return obj
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+            (self.max_entries and len(self._entries) > self.max_entries)
+            or (self.max_memory_bytes and self.memory_bytes() > self.max_memory_bytes)
+        ):
+            key, _ = self._entries.popitem(last=False)
+            logger.debug(f">>>>evict {key[0]}: {key[1]}")
+
+    def memory_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def get_tokenizer(self, name: str) -> T5Tokenizer:
+        return self._get_or_load("tokenizer", name, T5Tokenizer.from_pretrained)
+
+    def get_summarizer(self, name: str) -> T5ForConditionalGeneration:
+        def load(model_name: str):
+            model = T5ForConditionalGeneration.from_pretrained(model_name)
+            # inference only, shared read-only between requests
+            model.eval()
+            return model
+
+        return self._get_or_load("summarizer", name, load)
+
+    def warm(self, name: Optional[str], with_summarizer: bool = False):
+        if not name:
+            return
+        self.get_tokenizer(name)
+        if with_summarizer:
+            self.get_summarizer(name)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+model_registry = ModelRegistry(
+    max_entries=get_settings().TEXT_HANDLE_MODEL_CACHE_SIZE,
+    max_memory_mb=get_settings().TEXT_HANDLE_MODEL_CACHE_MB,
+)
+
+
+@on_settings_reload
+def _apply_model_registry_settings(settings):
+    # applied on the next load, cached entries are not evicted right away
+    model_registry.max_entries = settings.TEXT_HANDLE_MODEL_CACHE_SIZE
+    model_registry.max_memory_bytes = settings.TEXT_HANDLE_MODEL_CACHE_MB * 1024 * 1024
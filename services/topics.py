@@ -0,0 +1,130 @@
+import pickle
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.utils import murmurhash3_32
+
+from config.config import get_settings
+from database.messagesdb import retrieve_message_fields, retrieve_messages_after
+from database.usertopicmodeldb import get_user_topic_model, save_user_topic_model
+from models.usertopicmodel import UserTopicModel
+
+
+def _vectorizer(n_features: int) -> HashingVectorizer:
+    # LDA needs raw non-negative counts
+    return HashingVectorizer(
+        n_features=n_features,
+        stop_words="english",
+        alternate_sign=False,
+        norm=None,
+    )
+
+
+def load_state(state: Optional[bytes]) -> Optional[Dict]:
+    return pickle.loads(zlib.decompress(state)) if state else None
+
+
+def dump_state(state: Dict) -> bytes:
+    return zlib.compress(pickle.dumps(state))
+
+
+def fit_topic_model(
+    state: Optional[bytes],
+    texts: List[str],
+    n_docs: int,
+    n_features: int,
+    n_topics: int,
+) -> bytes:
+    """
+    partial_fit the user's online LDA with new texts only, runs in the analysis pool
+    """
+    model = load_state(state)
+    if model is None:
+        model = {
+            "lda": LatentDirichletAllocation(
+                n_components=n_topics, learning_method="online", random_state=0
+            ),
+            "n_features": n_features,
+            "terms": {},
+        }
+    vectorizer = _vectorizer(model["n_features"])
+    analyzer = vectorizer.build_analyzer()
+    # hashing is one way, remember which term landed in each bucket
+    terms = model["terms"]
+    for text in texts:
+        for term in analyzer(text):
+            bucket = abs(murmurhash3_32(term, seed=0)) % model["n_features"]
+            terms.setdefault(bucket, term)
+
+    lda = model["lda"]
+    lda.total_samples = max(n_docs, 1)
+    lda.partial_fit(vectorizer.transform(texts))
+    return dump_state(model)
+
+
+def top_topic_terms(state: bytes, active_topics_top_n: int) -> List[str]:
+    model = load_state(state)
+    lda, terms = model["lda"], model["terms"]
+    # the topic holding most of the user's words
+    topic = lda.components_[np.argmax(lda.components_.sum(axis=1))]
+    top = [i for i in topic.argsort()[::-1] if i in terms][:active_topics_top_n]
+    return [terms[i] for i in reversed(top)]
+
+
+async def update_topic_model(user_name: str, bootstrap_count: int, run_in_pool):
+    """
+    fold messages stored since the last update into the user's topic model,
+    the first update starts from the latest `bootstrap_count` messages
+    """
+    settings = get_settings()
+    stored = await get_user_topic_model(user_name)
+    if stored is None:
+        rows = await retrieve_message_fields(
+            user_name, bootstrap_count, ("_id", "text", "ctime")
+        )
+        rows.reverse()
+    else:
+        rows = await retrieve_messages_after(
+            user_name,
+            (stored.last_ctime, stored.last_id),
+            settings.TOPIC_MODEL_MAX_BATCH,
+        )
+    return await fold_topic_rows(user_name, stored, rows, run_in_pool)
+
+
+async def fold_topic_rows(
+    user_name: str, stored: Optional[UserTopicModel], rows: List[Dict], run_in_pool
+) -> Optional[bytes]:
+    """
+    fit `rows` ({_id, text, ctime}, oldest first, all newer than `stored`)
+    into the user's topic model and store it, returns the model state
+    """
+    settings = get_settings()
+    if not rows:
+        return stored.state if stored else None
+
+    n_docs = (stored.n_docs if stored else 0) + len(rows)
+    state = await run_in_pool(
+        fit_topic_model,
+        stored.state if stored else None,
+        [row["text"] for row in rows],
+        n_docs,
+        settings.TOPIC_MODEL_FEATURES,
+        settings.TOPIC_MODEL_TOPICS,
+    )
+    saved = await save_user_topic_model(
+        user_name,
+        state,
+        n_docs,
+        rows[-1]["ctime"],
+        rows[-1]["_id"],
+        stored.version if stored else 0,
+    )
+    if not saved:
+        # another worker updated it meanwhile, use theirs
+        latest = await get_user_topic_model(user_name)
+        return latest.state if latest else state
+    return state
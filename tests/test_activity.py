@@ -0,0 +1,12 @@
+from services.activity import activity_buckets, top_active_hours
+
+
+def test_activity_buckets_local_time():
+    # 2024-01-29 (monday) 13:22:37 in Asia/Shanghai
+    assert activity_buckets(1706505757000) == (13, 13)
+
+
+def test_top_active_hours():
+    hours = {"1": 5, "2": 7, "17": 7, "9": 1, "23": 0}
+    assert top_active_hours(hours, 3) == ["1:00-2:00", "2:00-3:00", "17:00-18:00"]
+    assert top_active_hours({"23": 0}, 3) == []
@@ -0,0 +1,136 @@
+import os
+
+import pytest
+from beanie import init_beanie
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from jobs import behavior_report
+from models.userbehaviorreport import UserBehaviorReport
+from models.usertopicmodel import UserTopicModel
+from services import topics
+from services.topics import fit_topic_model
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for row in self.rows:
+            yield row
+
+
+def _message(ctime: int, text: str):
+    return {"_id": ObjectId(), "text": text, "ctime": ctime}
+
+
+def _row(user_name, recent, hours):
+    return {
+        "_id": user_name,
+        "latest_ctime": recent[0]["ctime"],
+        "messages": sum(hours.values()),
+        **{f"hour_{hour}": hours.get(hour, 0) for hour in range(24)},
+        "recent": recent,
+    }
+
+
+@pytest.mark.anyio
+async def test_reports_come_from_one_aggregation_pass(mocker):
+    aa_recent = [_message(3, "cats purr cats"), _message(2, "old news")]
+    bb_recent = [_message(5, "football match"), _message(4, "football goal")]
+    aa_stored = UserTopicModel.model_construct(
+        user_name="aa",
+        state=fit_topic_model(None, ["old news"], 1, 64, 2),
+        n_docs=1,
+        last_ctime=2,
+        last_id=aa_recent[1]["_id"],
+        version=1,
+    )
+    rows = [
+        _row("aa", aa_recent, {9: 5, 21: 2}),
+        _row("bb", bb_recent, {1: 1, 2: 3, 3: 2}),
+    ]
+
+    async def initiate_database():
+        await init_beanie(
+            database=AsyncMongoMockClient()["chatbot"],
+            document_models=[UserBehaviorReport],
+        )
+
+    mocker.patch.object(behavior_report, "initiate_database", initiate_database)
+    messages = mocker.patch.object(behavior_report, "Messages")
+    messages.get_motor_collection.return_value.aggregate.return_value = FakeCursor(
+        rows
+    )
+    get_models = mocker.patch.object(
+        behavior_report, "get_user_topic_models", return_value={"aa": aa_stored}
+    )
+    mocker.patch.object(topics, "save_user_topic_model", return_value=True)
+    # no per-user message reads
+    mocker.patch.object(topics, "retrieve_message_fields", side_effect=AssertionError)
+    mocker.patch.object(topics, "retrieve_messages_after", side_effect=AssertionError)
+    save = mocker.patch.object(behavior_report, "bulk_save_user_behavior_reports")
+    fitted = {}
+
+    async def run_in_pool(func, state, texts, *args):
+        fitted[texts[0]] = texts
+        return func(state, texts, *args)
+
+    mocker.patch.object(behavior_report, "run_in_analysis_pool", run_in_pool)
+
+    await behavior_report.run(100, 2, 2, workers=2)
+
+    get_models.assert_called_once()
+    # only messages newer than the stored model are folded in, oldest first
+    assert sorted(fitted.values()) == [
+        ["cats purr cats"],
+        ["football goal", "football match"],
+    ]
+    reports = {report.user_name: report for report in save.call_args.args[0]}
+    assert reports["aa"].active_hours == ["9:00-10:00", "21:00-22:00"]
+    assert reports["bb"].active_hours == ["2:00-3:00", "3:00-4:00"]
+    assert reports["bb"].latest_ctime == 5
+    assert "football" in reports["bb"].active_topics
+
+
+def test_progress_counts_messages():
+    progress = behavior_report.Progress()
+    progress.add(10)
+    progress.add(5)
+    assert (progress.users, progress.messages) == (2, 15)
+
+
+@pytest.mark.skipif(not MONGO_TEST_URL, reason="MONGO_TEST_URL not set")
+@pytest.mark.anyio
+async def test_behavior_pipeline_on_mongodb():
+    # $firstN and $toDate are not supported by mongomock
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGO_TEST_URL)
+    collection = client["chatbot_behavior_test"]["messages"]
+    try:
+        # 2024-01-26 21:22 and 22:22 in Asia/Shanghai
+        await collection.insert_many(
+            [
+                {"user_name": "meng", "text": f"hi {i}", "ctime": ctime}
+                for i, ctime in enumerate([1706275357000, 1706278957000, 1706278958000])
+            ]
+        )
+        rows = await collection.aggregate(behavior_report.behavior_pipeline(2)).to_list(
+            None
+        )
+    finally:
+        await client.drop_database("chatbot_behavior_test")
+
+    assert len(rows) == 1
+    row = rows[0]
+    assert row["latest_ctime"] == 1706278958000
+    assert row["messages"] == 3
+    assert (row["hour_21"], row["hour_22"]) == (1, 2)
+    assert [message["text"] for message in row["recent"]] == ["hi 2", "hi 1"]
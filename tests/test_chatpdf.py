@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from fastapi import HTTPException
+from langchain.storage import LocalFileStore
+from langchain_core.documents import Document
+
+pytest.importorskip("chromadb")
+
+from config.config import get_settings  # noqa: E402
+from models.api import FileChatReq  # noqa: E402
+from services import chatpdf  # noqa: E402
+from services.embeddings import CachedEmbeddings  # noqa: E402
+from tests.test_embeddings import SlowEmbeddings  # noqa: E402
+
+
+class FakeDocsearch:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.added: List[int] = []
+
+    def add_documents(self, documents):
+        self.added.append(len(documents))
+        self.embeddings.embed_documents([doc.page_content for doc in documents])
+
+    def persist(self):
+        pass
+
+
+@pytest.mark.anyio
+async def test_feed_data_spans_fill_every_embedding_request(tmp_path, mocker):
+    settings = get_settings().model_copy(
+        update={
+            "EMBEDDING_BATCH_SIZE": 2,
+            "EMBEDDING_MAX_CONCURRENCY": 3,
+            "INGEST_EMBED_BATCH_SIZE": 0,
+        }
+    )
+    mocker.patch.object(chatpdf, "get_settings", return_value=settings)
+    underlying = SlowEmbeddings()
+    docsearch = FakeDocsearch(
+        CachedEmbeddings(
+            underlying,
+            "test-model",
+            LocalFileStore(tmp_path),
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+        )
+    )
+    mocker.patch.object(chatpdf, "get_docsearch", return_value=docsearch)
+    mocker.patch.object(chatpdf, "text_summarize", return_value="summary")
+
+    async def iter_pages(file_path):
+        for i in range(12):
+            yield Document(page_content=f"page {i}", metadata={"page": i})
+
+    mocker.patch.object(chatpdf, "iter_pages", iter_pages)
+
+    assert await chatpdf.feed_data("a.pdf", "doc") == "summary"
+
+    # one chunk per page, spans of batch size * concurrency
+    assert docsearch.added == [6, 6]
+    assert underlying.max_in_flight > 1
+
+
+class FakeQueryEmbeddings:
+    def __init__(self):
+        self.queries: List[str] = []
+
+    async def aembed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+
+class FakeVectorstore:
+    def __init__(self):
+        self.vectors = []
+
+    async def asimilarity_search_by_vector(self, vector, k=4):
+        self.vectors.append(vector)
+        return [Document(page_content="context")]
+
+
+class FakeQA:
+    """
+    a RetrievalQA whose own retrieval (arun) would embed the question again
+    """
+
+    def __init__(self, on_arun=None):
+        self.retriever = SimpleNamespace(
+            vectorstore=FakeVectorstore(), search_kwargs={}
+        )
+        self.combine_documents_chain = SimpleNamespace(arun=self._combine)
+        self.on_arun = on_arun
+        self.arun_calls = 0
+
+    async def _combine(self, input_documents, question):
+        return f"answer to {question}"
+
+    async def arun(self, question):
+        self.arun_calls += 1
+        if self.on_arun:
+            self.on_arun()
+        return await self._combine([], question)
+
+
+@pytest.fixture
+def chat(mocker):
+    embeddings = FakeQueryEmbeddings()
+    mocker.patch.object(chatpdf, "get_embeddings", return_value=embeddings)
+    mocker.patch.object(chatpdf, "get_document_version", return_value="0")
+    cache = mocker.patch.object(chatpdf, "semantic_cache")
+    cache.get.return_value = None
+    return embeddings, cache
+
+
+@pytest.mark.anyio
+async def test_cache_miss_embeds_the_question_once(chat, mocker):
+    embeddings, cache = chat
+    cache.max_entries = 10
+    qa = FakeQA()
+    mocker.patch.object(chatpdf, "get_qa_instance", return_value=qa)
+
+    response = await chatpdf.pdf_chat(FileChatReq(document_id="doc", message="hi"))
+
+    assert response == {"response": "answer to hi"}
+    assert embeddings.queries == ["hi"]
+    # retrieval used the vector of the cache lookup
+    assert qa.retriever.vectorstore.vectors == [[1.0, 0.0]]
+    assert qa.arun_calls == 0
+    cache.put.assert_called_once_with("doc", "hi", [1.0, 0.0], "answer to hi")
+
+
+@pytest.mark.anyio
+async def test_cache_enabled_by_reload_mid_request(chat, mocker):
+    embeddings, cache = chat
+    cache.max_entries = 0
+
+    def enable_cache():
+        cache.max_entries = 10
+
+    mocker.patch.object(
+        chatpdf, "get_qa_instance", return_value=FakeQA(on_arun=enable_cache)
+    )
+
+    response = await chatpdf.pdf_chat(FileChatReq(document_id="doc", message="hi"))
+
+    assert response == {"response": "answer to hi"}
+    assert embeddings.queries == []
+    cache.put.assert_not_called()
+
+
+@pytest.fixture
+def qa_cache(mocker):
+    settings = get_settings().model_copy(update={"QA_INSTANCE_CACHE_SIZE": 2})
+    mocker.patch.object(chatpdf, "get_settings", return_value=settings)
+    mocker.patch.object(chatpdf, "_qa_instances", OrderedDict())
+    exists = {"a": True, "b": True, "c": True}
+    mocker.patch.object(chatpdf, "document_exists", side_effect=exists.get)
+    mocker.patch.object(
+        chatpdf, "initialize_qa_instance", side_effect=lambda _: object()
+    )
+    cache = mocker.patch.object(chatpdf, "semantic_cache")
+    versions = {}
+
+    def incr(key):
+        versions[key] = str(int(versions.get(key, 0)) + 1)
+
+    async def aget(key):
+        return versions.get(key)
+
+    mocker.patch.object(chatpdf, "incr", incr)
+    mocker.patch.object(chatpdf, "aget", aget)
+    return exists, cache
+
+
+def _invalidated(cache):
+    return [call.args[0] for call in cache.invalidate.call_args_list]
+
+
+def test_least_recently_used_chain_is_evicted(qa_cache):
+    _, cache = qa_cache
+    a = chatpdf.get_qa_instance("a")
+    chatpdf.get_qa_instance("b")
+    assert chatpdf.get_qa_instance("a") is a
+    chatpdf.get_qa_instance("c")
+
+    assert list(chatpdf._qa_instances) == ["a", "c"]
+    # answers cached for an evicted chain go with it
+    assert _invalidated(cache) == ["b"]
+    assert chatpdf.get_qa_instance("a") is a
+
+
+@pytest.mark.anyio
+async def test_chain_is_dropped_after_a_delete_elsewhere(qa_cache):
+    exists, cache = qa_cache
+    version = await chatpdf.get_document_version("a")
+    stale = chatpdf.get_qa_instance("a", version)
+
+    # another worker deletes the document: the collection is gone and the
+    # version is bumped, this worker's cache isn't touched
+    exists["a"] = False
+    chatpdf.incr(chatpdf._version_key("a"))
+    version = await chatpdf.get_document_version("a")
+
+    with pytest.raises(HTTPException) as e:
+        chatpdf.get_qa_instance("a", version)
+    assert e.value.status_code == 404
+    assert "a" not in chatpdf._qa_instances
+    assert _invalidated(cache) == ["a"]
+
+    # uploaded again, a fresh chain is built for the new collection
+    exists["a"] = True
+    assert chatpdf.get_qa_instance("a", version) is not stale
@@ -0,0 +1,20 @@
+from config import config
+from models.api import ChatReq
+
+
+def test_reload_runs_hooks_with_new_settings(monkeypatch):
+    monkeypatch.setattr(config, "_reload_hooks", [])
+    seen = []
+    config.on_settings_reload(lambda settings: seen.append(settings))
+    # a failing hook doesn't stop the others
+    config.on_settings_reload(lambda settings: 1 / 0)
+    config.on_settings_reload(lambda settings: seen.append(settings))
+
+    settings = config.reload_settings()
+
+    assert seen == [settings, settings]
+    assert config.get_settings() is settings
+
+
+def test_chat_req_max_tokens_is_resolved_per_request():
+    assert ChatReq(message="hi", user_name="aa").max_tokens is None
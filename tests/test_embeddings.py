@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import List
+
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+
+from services import embeddings as embeddings_module
+from services.embeddings import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(texts)
+        return [[float(len(text)), 0.5] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), 0.5]
+
+
+class SlowEmbeddings(CountingEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self._lock:
+            self.in_flight -= 1
+        return super().embed_documents(texts)
+
+
+def test_cached_embeddings_only_embeds_misses(tmp_path):
+    underlying = CountingEmbeddings()
+    embeddings = CachedEmbeddings(
+        underlying, "test-model", LocalFileStore(tmp_path), batch_size=2
+    )
+
+    first = embeddings.embed_documents(["a", "bb", "a", "ccc"])
+    assert first == [[1.0, 0.5], [2.0, 0.5], [1.0, 0.5], [3.0, 0.5]]
+    # duplicates are embedded once, misses go in batch_size batches
+    assert sorted(len(batch) for batch in underlying.calls) == [1, 2]
+
+    underlying.calls.clear()
+    assert embeddings.embed_documents(["ccc", "dddd"]) == [[3.0, 0.5], [4.0, 0.5]]
+    assert underlying.calls == [["dddd"]]
+
+
+def test_cache_is_keyed_by_model(tmp_path):
+    underlying = CountingEmbeddings()
+    store = LocalFileStore(tmp_path)
+    CachedEmbeddings(underlying, "model-a", store).embed_documents(["a"])
+    CachedEmbeddings(underlying, "model-b", store).embed_documents(["a"])
+    assert len(underlying.calls) == 2
+
+
+def test_queries_are_not_stored(tmp_path):
+    underlying = CountingEmbeddings()
+    store = LocalFileStore(tmp_path)
+    embeddings = CachedEmbeddings(underlying, "test-model", store)
+
+    assert embeddings.embed_query("a question") == [10.0, 0.5]
+    assert list(store.yield_keys()) == []
+
+
+def test_miss_batches_are_embedded_concurrently(tmp_path):
+    underlying = SlowEmbeddings()
+    embeddings = CachedEmbeddings(
+        underlying, "test-model", LocalFileStore(tmp_path), batch_size=2
+    )
+
+    embeddings.embed_documents([str(i) for i in range(8)])
+
+    assert len(underlying.calls) == 4
+    assert underlying.max_in_flight > 1
+
+
+def test_get_embeddings_is_shared_until_settings_reload(tmp_path, mocker):
+    mocker.patch.object(embeddings_module, "_embeddings", None)
+    mocker.patch.object(embeddings_module, "EMBEDDING_CACHE_DIR", str(tmp_path))
+    client = mocker.patch.object(embeddings_module, "OpenAIEmbeddings")
+
+    first = embeddings_module.get_embeddings()
+    assert embeddings_module.get_embeddings() is first
+    client.assert_called_once()
+
+    embeddings_module._reset_embeddings(None)
+    assert embeddings_module.get_embeddings() is not first
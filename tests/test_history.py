@@ -0,0 +1,88 @@
+import json
+
+import pytest
+from beanie import init_beanie
+from bson import ObjectId
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from models.messages import Messages
+from services.messages import (
+    _decode_cursor,
+    _encode_cursor,
+    export_chat_history,
+    get_chat_history_page,
+)
+
+
+@pytest.fixture
+async def messages():
+    await init_beanie(
+        database=AsyncMongoMockClient()["chatbot"], document_models=[Messages]
+    )
+    # ties on ctime, _id keeps their insertion order
+    rows = [
+        {
+            "_id": ObjectId(),
+            "user_name": "aa",
+            "type": "user" if i % 2 == 0 else "ai",
+            "text": f"hello {i}",
+            "ctime": ctime,
+            "mtime": ctime,
+        }
+        for i, ctime in enumerate([1, 2, 2, 2, 3])
+    ]
+    other = {**rows[0], "_id": ObjectId(), "user_name": "bb", "text": "not mine"}
+    await Messages.get_motor_collection().insert_many(rows + [other])
+    return rows
+
+
+async def _all_pages(limit):
+    pages, cursor = [], None
+    while True:
+        page = await get_chat_history_page("aa", limit, cursor)
+        pages.append([message.text for message in page.messages])
+        if page.next_cursor is None:
+            return pages
+        cursor = page.next_cursor
+
+
+@pytest.mark.anyio
+async def test_pages_walk_ties_on_ctime_without_gaps(messages):
+    pages = await _all_pages(2)
+
+    assert pages == [["hello 3", "hello 4"], ["hello 1", "hello 2"], ["hello 0"]]
+
+
+@pytest.mark.anyio
+async def test_last_full_page_is_followed_by_an_empty_one(messages):
+    pages = await _all_pages(5)
+
+    assert pages == [[f"hello {i}" for i in range(5)], []]
+
+
+def test_cursor_round_trip():
+    row = {"ctime": 1706275357000, "_id": ObjectId()}
+
+    assert _decode_cursor(_encode_cursor(row)) == (row["ctime"], row["_id"])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "cursor", ["abc", "1706275357000", f"x_{ObjectId()}", "1706275357000_zz"]
+)
+async def test_invalid_cursor_is_a_bad_request(messages, cursor):
+    with pytest.raises(HTTPException) as e:
+        await get_chat_history_page("aa", 2, cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_export_is_oldest_first_ndjson(messages):
+    lines = [line async for line in export_chat_history("aa")]
+
+    assert all(line.endswith("\n") for line in lines)
+    assert [json.loads(line) for line in lines] == [
+        {"type": row["type"], "text": row["text"], "ctime": row["ctime"]}
+        for row in messages
+    ]
@@ -0,0 +1,70 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import vendor.redis as redis_helpers  # noqa: E402
+from database.messagesdb import MessageRow  # noqa: E402
+from models.messages import Messages  # noqa: E402
+from services import historycache  # noqa: E402
+
+
+def _message(i: int) -> Messages:
+    return Messages.model_construct(
+        user_name="aa", type="user", text=f"hello {i}", ctime=i, mtime=i
+    )
+
+
+def _row(i: int) -> MessageRow:
+    return MessageRow(type="user", text=f"hello {i}", ctime=i)
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    conn = fakeredis.FakeAsyncRedis()
+
+    async def alrange(key, start, end):
+        return [v.decode() for v in await conn.lrange(key, start, end)]
+
+    async def capped_append(*args):
+        return await redis_helpers.capped_append(*args, conn=conn)
+
+    async def capped_fill_begin(*args):
+        return await redis_helpers.capped_fill_begin(*args, conn=conn)
+
+    async def capped_fill(*args):
+        return await redis_helpers.capped_fill(*args, conn=conn)
+
+    mocker.patch.object(historycache, "alrange", alrange)
+    mocker.patch.object(historycache, "capped_append", capped_append)
+    mocker.patch.object(historycache, "capped_fill_begin", capped_fill_begin)
+    mocker.patch.object(historycache, "capped_fill", capped_fill)
+    return conn
+
+
+def _texts(messages):
+    return [message.text for message in messages]
+
+
+@pytest.mark.anyio
+async def test_fill_keeps_messages_flushed_during_the_miss(fake_redis, mocker):
+    async def retrieve_message_rows(user_name, last_n):
+        # 2 was flushed after the fill began but before mongo was read,
+        # 3 after the read, neither append found the list
+        await historycache.append_history([_message(2)])
+        rows = [_row(2), _row(1)]
+        await historycache.append_history([_message(3)])
+        return rows
+
+    mocker.patch.object(historycache, "retrieve_message_rows", retrieve_message_rows)
+
+    missed = await historycache.get_recent_history("aa", 10)
+    assert _texts(missed) == ["hello 1", "hello 2"]
+
+    cached = await historycache._get_cached("aa", 10)
+    assert _texts(cached) == ["hello 1", "hello 2", "hello 3"]
+
+
+@pytest.mark.anyio
+async def test_append_without_list_or_fill_is_dropped(fake_redis):
+    await historycache.append_history([_message(1)])
+    assert await fake_redis.keys("*") == []
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+from beanie import init_beanie
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import models as models
+from config.config import verify_indexes
+from models.messages import Messages
+from models.userlimits import UserLimits
+
+# explain() is not supported by mongomock, these run against a real mongodb
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+pytestmark = pytest.mark.skipif(not MONGO_TEST_URL, reason="MONGO_TEST_URL not set")
+
+
+def _stages(plan):
+    yield plan["stage"]
+    for key in ("inputStage", "inputStages"):
+        children = plan.get(key, [])
+        for child in children if isinstance(children, list) else [children]:
+            yield from _stages(child)
+
+
+@pytest.fixture
+async def database():
+    client = AsyncIOMotorClient(MONGO_TEST_URL)
+    db = client["chatbot_index_test"]
+    await init_beanie(database=db, document_models=models.__all__)
+    yield db
+    await client.drop_database("chatbot_index_test")
+
+
+@pytest.mark.anyio
+async def test_indexes_created(database):
+    await verify_indexes()
+
+
+@pytest.mark.anyio
+async def test_retrieve_messages_uses_index(database):
+    explain = await Messages.get_motor_collection().find(
+        {"user_name": "meng"}
+    ).sort([("ctime", -1)]).limit(10).explain()
+    stages = list(_stages(explain["queryPlanner"]["winningPlan"]))
+    assert "IXSCAN" in stages
+    assert "COLLSCAN" not in stages
+    # the index already gives ctime order
+    assert "SORT" not in stages
+
+
+@pytest.mark.anyio
+async def test_retrieve_messages_page_uses_index(database):
+    explain = await Messages.get_motor_collection().find(
+        {
+            "user_name": "meng",
+            "$or": [
+                {"ctime": {"$lt": 10}},
+                {"ctime": 10, "_id": {"$lt": ObjectId()}},
+            ],
+        }
+    ).sort([("ctime", -1), ("_id", -1)]).limit(10).explain()
+    stages = list(_stages(explain["queryPlanner"]["winningPlan"]))
+    assert "COLLSCAN" not in stages
+
+
+@pytest.mark.anyio
+async def test_get_userlimit_uses_index(database):
+    explain = await UserLimits.get_motor_collection().find(
+        {"user_name": "meng", "use_date": "2024-01-29"}
+    ).explain()
+    stages = list(_stages(explain["queryPlanner"]["winningPlan"]))
+    assert "IXSCAN" in stages
+    assert "COLLSCAN" not in stages
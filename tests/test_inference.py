@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from services.inference import SummarizeBatcher, _Job  # noqa: E402
+
+
+class FakeBatcher(SummarizeBatcher):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def _summarize(self, model, max_length, texts):
+        self.release.wait()
+        self.batches.append(texts)
+        return [text.upper() for text in texts]
+
+
+@pytest.mark.anyio
+async def test_concurrent_requests_share_a_batch():
+    batcher = FakeBatcher(max_batch_size=8, max_wait_ms=50)
+
+    summaries = await asyncio.gather(
+        *[batcher.summarize("m", f"text {i}", 10) for i in range(4)]
+    )
+
+    assert summaries == [f"TEXT {i}" for i in range(4)]
+    assert len(batcher.batches) == 1
+    batcher.stop()
+
+
+@pytest.mark.anyio
+async def test_cancelled_request_does_not_break_the_batch():
+    batcher = FakeBatcher(max_batch_size=8, max_wait_ms=50)
+
+    cancelled = asyncio.ensure_future(batcher.summarize("m", "gone", 10))
+    kept = asyncio.ensure_future(batcher.summarize("m", "kept", 10))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await kept == "KEPT"
+    assert batcher.batches == [["kept"]]
+    # the worker survived and keeps serving
+    assert await batcher.summarize("m", "again", 10) == "AGAIN"
+    batcher.stop()
+
+
+@pytest.mark.anyio
+async def test_stop_fails_jobs_queued_behind_the_sentinel():
+    batcher = FakeBatcher(max_batch_size=1, max_wait_ms=0)
+    batcher.release.clear()
+    running = asyncio.ensure_future(batcher.summarize("m", "running", 10))
+    await asyncio.sleep(0.05)
+
+    stopping = asyncio.get_running_loop().run_in_executor(None, batcher.stop, 1)
+    await asyncio.sleep(0.05)
+    # a request racing the shutdown lands after the sentinel
+    late = _Job("m", "late", 10)
+    batcher._queue.put(late)
+    batcher.release.set()
+    await stopping
+
+    assert await running == "RUNNING"
+    with pytest.raises(RuntimeError):
+        await asyncio.wrap_future(late.future)
+
+
+@pytest.mark.anyio
+async def test_summarize_after_stop_does_not_restart_the_thread():
+    batcher = FakeBatcher()
+    assert await batcher.summarize("m", "before", 10) == "BEFORE"
+    await asyncio.to_thread(batcher.stop)
+
+    with pytest.raises(RuntimeError):
+        await batcher.summarize("m", "after", 10)
+    assert batcher._thread is None
+
+    # an explicit start serves again
+    batcher.start()
+    assert await batcher.summarize("m", "again", 10) == "AGAIN"
+    batcher.stop()
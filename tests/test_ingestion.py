@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("chromadb")
+fakeredis = pytest.importorskip("fakeredis")
+
+import vendor.redis as redis_helpers  # noqa: E402
+from services import ingestion  # noqa: E402
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    conn = fakeredis.FakeAsyncRedis()
+
+    async def aset_nx(key, value, expire):
+        return bool(await conn.set(key, value, ex=expire, nx=True))
+
+    async def release_claim(*args):
+        return await redis_helpers.release_claim(*args, conn=conn)
+
+    async def refresh_claim(*args):
+        return await redis_helpers.refresh_claim(*args, conn=conn)
+
+    mocker.patch.object(ingestion, "aset_nx", aset_nx)
+    mocker.patch.object(ingestion, "release_claim", release_claim)
+    mocker.patch.object(ingestion, "refresh_claim", refresh_claim)
+    mocker.patch.object(ingestion, "update_job")
+    mocker.patch.object(ingestion, "CLAIM_POLL_INTERVAL", 0.01)
+    return conn
+
+
+@pytest.mark.anyio
+async def test_concurrent_uploads_of_one_file_embed_once(fake_redis, mocker):
+    ingested = {}
+    mocker.patch.object(ingestion, "get_ingested_file", ingested.get)
+    mocker.patch.object(
+        ingestion, "set_ingested_file", lambda key, value: ingested.update({key: value})
+    )
+    mocker.patch.object(ingestion, "document_exists", return_value=False)
+
+    async def feed_data(file_path, document_id, progress):
+        await progress(pages_parsed=1)
+        await asyncio.sleep(0.05)
+        return "summary"
+
+    feed = mocker.patch.object(ingestion, "feed_data", side_effect=feed_data)
+    queue = ingestion.IngestQueue()
+
+    await asyncio.gather(
+        queue._ingest("job-1", "a.pdf", "hash"), queue._ingest("job-2", "b.pdf", "hash")
+    )
+
+    feed.assert_called_once()
+    assert await fake_redis.get(ingestion._claim_key("hash")) is None
+
+
+@pytest.mark.anyio
+async def test_failed_ingest_keeps_a_collection_it_did_not_create(fake_redis, mocker):
+    mocker.patch.object(ingestion, "get_ingested_file", return_value=None)
+    mocker.patch.object(ingestion, "document_exists", return_value=True)
+    mocker.patch.object(ingestion, "feed_data", side_effect=RuntimeError("boom"))
+    delete_document = mocker.patch.object(ingestion, "delete_document")
+
+    await ingestion.IngestQueue()._ingest("job-1", "a.pdf", "hash")
+
+    delete_document.assert_not_called()
+
+
+@pytest.fixture
+def jobs(mocker):
+    jobs = {}
+
+    async def update_job(job_id, /, **fields):
+        jobs.setdefault(job_id, {}).update(fields)
+
+    mocker.patch.object(ingestion, "update_job", update_job)
+    return jobs
+
+
+@pytest.mark.anyio
+async def test_worker_survives_a_redis_error(fake_redis, jobs, mocker):
+    mocker.patch.object(ingestion, "get_ingested_file", return_value={"summary": "s"})
+    aset_nx = ingestion.aset_nx
+
+    async def flaky_aset_nx(key, value, expire):
+        if value == failing:
+            raise ConnectionError("redis down")
+        return await aset_nx(key, value, expire)
+
+    mocker.patch.object(ingestion, "aset_nx", flaky_aset_nx)
+    queue = ingestion.IngestQueue(workers=1)
+    failing = await queue.submit("a.pdf", "a.pdf", 1, "hash-a")
+    done = await queue.submit("b.pdf", "b.pdf", 1, "hash-b")
+    await queue._queue.join()
+    await queue.stop()
+
+    assert jobs[failing]["status"] == "failed"
+    assert jobs[done]["status"] == "done"
+
+
+@pytest.mark.anyio
+async def test_submit_never_overfills_the_queue(fake_redis, jobs, mocker):
+    update_job = ingestion.update_job
+
+    async def slow_update_job(job_id, /, **fields):
+        await asyncio.sleep(0.01)
+        await update_job(job_id, **fields)
+
+    mocker.patch.object(ingestion, "update_job", slow_update_job)
+    queue = ingestion.IngestQueue(workers=0, max_size=1)
+
+    results = await asyncio.gather(
+        queue.submit("a.pdf", "a.pdf", 1, "hash-a"),
+        queue.submit("b.pdf", "b.pdf", 1, "hash-b"),
+        return_exceptions=True,
+    )
+
+    accepted = [r for r in results if isinstance(r, str)]
+    rejected = [r for r in results if isinstance(r, ingestion.HTTPException)]
+    assert len(accepted) == 1 and len(rejected) == 1
+    assert rejected[0].status_code == 503
+    # no job record is left behind for the rejected upload
+    assert list(jobs) == accepted
+    await queue.stop()
+
+
+@pytest.mark.anyio
+async def test_stop_cleans_up_a_running_ingestion(fake_redis, jobs, mocker):
+    mocker.patch.object(ingestion, "get_ingested_file", return_value=None)
+    mocker.patch.object(ingestion, "document_exists", return_value=False)
+    delete_document = mocker.patch.object(ingestion, "delete_document")
+    started = asyncio.Event()
+
+    async def feed_data(file_path, document_id, progress):
+        started.set()
+        await asyncio.Event().wait()
+
+    mocker.patch.object(ingestion, "feed_data", feed_data)
+    queue = ingestion.IngestQueue(workers=1)
+    running = await queue.submit("a.pdf", "a.pdf", 1, "hash")
+    waiting = await queue.submit("b.pdf", "b.pdf", 1, "other")
+    await started.wait()
+
+    await queue.stop()
+
+    delete_document.assert_called_once_with("hash")
+    assert jobs[running]["status"] == "failed"
+    assert jobs[waiting]["status"] == "failed"
+    assert await fake_redis.get(ingestion._claim_key("hash")) is None
@@ -0,0 +1,56 @@
+import pytest
+from beanie import init_beanie
+from mongomock_motor import AsyncMongoMockClient
+
+from database.messagesdb import (
+    MessageRow,
+    get_message_models,
+    retrieve_message_fields,
+    retrieve_message_rows,
+    retrieve_messages,
+)
+from models.messages import Messages, MessagesModel
+
+
+@pytest.fixture
+async def messages():
+    await init_beanie(
+        database=AsyncMongoMockClient()["chatbot"], document_models=[Messages]
+    )
+    for i in range(5):
+        await Messages(
+            user_name="aa",
+            type="user" if i % 2 == 0 else "ai",
+            text=f"hello {i}",
+            ctime=i,
+            mtime=i + 100,
+        ).create()
+    await Messages(user_name="bb", type="user", text="no", ctime=9, mtime=9).create()
+
+
+@pytest.mark.anyio
+async def test_rows_match_full_document_reads(messages):
+    documents = await retrieve_messages("aa", 3)
+    rows = await retrieve_message_rows("aa", 3)
+
+    assert all(isinstance(row, MessageRow) for row in rows)
+    assert [(row.type, row.text, row.ctime) for row in rows] == [
+        (doc.type, doc.text, doc.ctime) for doc in documents
+    ]
+    assert [row.ctime for row in rows] == [4, 3, 2]
+
+
+@pytest.mark.anyio
+async def test_message_models_match_full_document_reads(messages):
+    documents = await retrieve_messages("aa", 10)
+
+    assert await get_message_models("aa", 10) == [
+        MessagesModel(type=doc.type, text=doc.text) for doc in reversed(documents)
+    ]
+
+
+@pytest.mark.anyio
+async def test_fields_projection_holds_only_the_requested_fields(messages):
+    rows = await retrieve_message_fields("aa", 2, ("text",))
+
+    assert rows == [{"text": "hello 4"}, {"text": "hello 3"}]
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from commons.enums import MESSAGE_WRITE_MODE
+from models.messages import Messages
+from services.messagesink import MessageSink
+
+
+def _message(i: int) -> Messages:
+    return Messages.model_construct(
+        user_name="aa", type="user", text=f"hello {i}", ctime=i, mtime=i
+    )
+
+
+@pytest.mark.anyio
+async def test_ack_mode_batches_concurrent_messages(mocker):
+    add_messages = mocker.patch("services.messagesink.add_messages")
+    mocker.patch("services.messagesink.append_history")
+    sink = MessageSink(MESSAGE_WRITE_MODE.ACK, max_batch_size=10, interval_ms=20)
+
+    await sink.wait(*[sink.put(_message(i)) for i in range(25)])
+
+    sizes = [len(call.args[0]) for call in add_messages.call_args_list]
+    assert sizes == [10, 10, 5]
+    await sink.stop()
+
+
+@pytest.mark.anyio
+async def test_async_mode_flushes_on_stop(mocker):
+    add_messages = mocker.patch("services.messagesink.add_messages")
+    mocker.patch("services.messagesink.append_history")
+    sink = MessageSink(MESSAGE_WRITE_MODE.ASYNC, max_batch_size=10, interval_ms=1000)
+
+    assert sink.put(_message(1)) is None
+    await asyncio.sleep(0)
+    await sink.stop()
+
+    add_messages.assert_called_once()
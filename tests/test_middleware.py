@@ -0,0 +1,74 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from commons.middleware import BodySizeLimitMiddleware
+
+MAX_BYTES = 1024
+BOUNDARY = "boundary"
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(
+        BodySizeLimitMiddleware,
+        max_bytes=MAX_BYTES,
+        paths=("/upload",),
+        detail="too large",
+    )
+    app.state.handled = 0
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        app.state.handled += 1
+        return {"size": len(await file.read())}
+
+    return app
+
+
+def _multipart_chunks(size: int, chunk_size: int = 256):
+    yield (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode()
+    for start in range(0, size, chunk_size):
+        yield b"x" * min(chunk_size, size - start)
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _post(client, size, **headers):
+    return client.post(
+        "/upload",
+        content=_multipart_chunks(size),
+        headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}", **headers},
+    )
+
+
+def test_small_upload_passes():
+    app = _app()
+    response = _post(TestClient(app), 100)
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}
+
+
+def test_chunked_upload_is_cut_off_while_received():
+    app = _app()
+    # no content-length, only the streamed bytes count
+    response = _post(TestClient(app), 10 * MAX_BYTES)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "too large"}
+    assert app.state.handled == 0
+
+
+def test_declared_size_over_limit():
+    app = _app()
+    response = _post(TestClient(app), 10, **{"content-length": str(10 * MAX_BYTES)})
+    assert response.status_code == 400
+    assert app.state.handled == 0
+
+
+def test_malformed_content_length():
+    app = _app()
+    response = _post(TestClient(app), 10, **{"content-length": "abc"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "invalid content-length header"}
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from services.modelrouter import ModelRouter, parse_models
+from vendor.openrouter import CircuitOpenError
+
+
+def test_parse_models():
+    assert parse_models("a:2, b,vendor/c:free", "x") == [
+        ("a", 2.0),
+        ("b", 1.0),
+        ("vendor/c:free", 1.0),
+    ]
+    assert parse_models("", "x") == [("x", 1.0)]
+
+
+def test_rank_prefers_fast_healthy_models():
+    router = ModelRouter(min_samples=2, max_error_rate=0.5)
+    for _ in range(3):
+        router.record("slow", 2.0, True)
+        router.record("fast", 0.5, True)
+        router.record("broken", 0.1, False)
+
+    models = [("broken", 1), ("slow", 1), ("fast", 1)]
+    assert router.rank(models) == ["fast", "slow", "broken"]
+    # weight trades latency for preference
+    assert router.rank([("slow", 10), ("fast", 1)]) == ["slow", "fast"]
+
+
+@pytest.mark.anyio
+async def test_call_falls_back_on_error():
+    router = ModelRouter()
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        if model == "a":
+            raise ValueError("bad response")
+        return model
+
+    assert await router.call([("a", 1), ("b", 1)], call) == "b"
+    assert calls == ["a", "b"]
+    assert router.snapshot()["a"]["error_rate"] == 1
+
+
+@pytest.mark.anyio
+async def test_call_skips_models_with_open_circuit():
+    router = ModelRouter()
+
+    async def call(model):
+        if model == "a":
+            raise CircuitOpenError()
+        return model
+
+    assert await router.call([("a", 1), ("b", 1)], call) == "b"
+    # failing fast says nothing about the model's latency or errors
+    assert router.snapshot()["a"]["samples"] == 0
+
+
+@pytest.mark.anyio
+async def test_hedge_waits_for_primary_when_backup_circuit_open():
+    router = ModelRouter()
+    cancelled = []
+
+    async def call(model):
+        if model == "b":
+            raise CircuitOpenError()
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    assert await router.call([("a", 1), ("b", 1)], call, hedge_after_ms=10) == "a"
+    assert cancelled == []
+
+
+@pytest.mark.anyio
+async def test_hedge_takes_first_answer():
+    router = ModelRouter()
+    cancelled = []
+
+    async def call(model):
+        try:
+            await asyncio.sleep(1 if model == "a" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    assert await router.call([("a", 1), ("b", 1)], call, hedge_after_ms=20) == "b"
+    await asyncio.sleep(0)
+    assert cancelled == ["a"]
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from vendor.openrouter import (
+    CircuitBreaker,
+    CircuitOpenError,
+    UpstreamClient,
+    iter_chat_deltas,
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # status codes answered in order, the last one repeats
+    statuses = [200]
+    requests = 0
+    # seconds to wait before answering
+    delay = 0
+
+    def do_POST(self):
+        cls = type(self)
+        status = cls.statuses[min(cls.requests, len(cls.statuses) - 1)]
+        cls.requests += 1
+        time.sleep(cls.delay)
+        payload = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        if payload.get("stream"):
+            chunks = [{"choices": [{"delta": {"content": word}}]} for word in ("h", "i")]
+            body = ": OPENROUTER PROCESSING\n\n" + "".join(
+                f"data: {json.dumps(chunk)}\n\n" for chunk in chunks
+            )
+            body = (body + "data: [DONE]\n\n").encode()
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({"choices": [{"message": {"content": "hi"}}]}).encode()
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.requests = 0
+    StubHandler.delay = 0
+    yield f"http://127.0.0.1:{server.server_address[1]}/chat", StubHandler
+    server.shutdown()
+
+
+def _client(**kwargs):
+    return UpstreamClient(httpx.AsyncClient(http2=True), backoff=0.001, **kwargs)
+
+
+@pytest.mark.anyio
+async def test_retries_retryable_status(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503, 502, 200]
+    client = _client(max_retries=2)
+
+    response = await client.post(url, headers={}, json={"model": "m"})
+
+    assert response.status_code == 200
+    assert handler.requests == 3
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_gives_up_after_max_retries(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503]
+    client = _client(max_retries=1)
+
+    response = await client.post(url, headers={}, json={})
+
+    assert response.status_code == 503
+    assert handler.requests == 2
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_does_not_retry_client_errors(stub_server):
+    url, handler = stub_server
+    handler.statuses = [400]
+    client = _client(max_retries=3)
+
+    response = await client.post(url, headers={}, json={})
+
+    assert response.status_code == 400
+    assert handler.requests == 1
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_circuit_opens_and_fails_fast(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503]
+    client = _client(
+        max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    )
+
+    await client.post(url, headers={}, json={})
+    await client.post(url, headers={}, json={})
+    with pytest.raises(CircuitOpenError):
+        await client.post(url, headers={}, json={})
+    assert handler.requests == 2
+
+    # after the reset timeout one trial request closes it again
+    client.breaker.reset_timeout = 0
+    handler.statuses = [200]
+    handler.requests = 0
+    response = await client.post(url, headers={}, json={})
+    assert response.status_code == 200
+    assert not client.breaker.is_open
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_stream_retries_then_relays_deltas(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503, 200]
+    client = _client(max_retries=1)
+
+    async with client.stream(url, headers={}, json={"stream": True}) as response:
+        assert response.status_code == 200
+        deltas = [delta async for delta in iter_chat_deltas(response)]
+
+    assert deltas == ["h", "i"]
+    assert handler.requests == 2
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_cancelled_trial_does_not_keep_circuit_open(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503]
+    client = _client(
+        max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    )
+    await client.post(url, headers={}, json={})
+    assert client.breaker.is_open
+
+    # the half open trial goes away before the upstream answers
+    handler.statuses = [200]
+    handler.delay = 0.5
+    trial = asyncio.ensure_future(client.post(url, headers={}, json={}))
+    await asyncio.sleep(0.1)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    handler.delay = 0
+    response = await client.post(url, headers={}, json={})
+    assert response.status_code == 200
+    assert not client.breaker.is_open
+    await client.aclose()
+
+
+@pytest.mark.anyio
+async def test_breaker_per_key(stub_server):
+    url, handler = stub_server
+    handler.statuses = [503]
+    client = _client(
+        max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    )
+
+    await client.post(url, headers={}, json={}, breaker_key="overloaded")
+    with pytest.raises(CircuitOpenError):
+        await client.post(url, headers={}, json={}, breaker_key="overloaded")
+
+    # other models keep their own closed circuit
+    handler.statuses = [200]
+    response = await client.post(url, headers={}, json={}, breaker_key="healthy")
+    assert response.status_code == 200
+    await client.aclose()
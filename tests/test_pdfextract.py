@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from pypdf.errors import PdfReadError
+
+from config.config import get_settings
+from services import pdfextract
+
+
+def write_pdf(path, texts):
+    """
+    a minimal pdf with one line of text per page
+    """
+    n = len(texts)
+    # 1 catalog, 2 pages, 3 font, then a page and its content stream per text
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(n)), n),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(texts):
+        stream = b"BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text.encode()
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(bytes(out))
+
+
+def slow_first_ranges(file_path, start, end):
+    # earlier ranges finish last, pages must still come out in order
+    time.sleep(max(0.0, 0.3 - start * 0.05))
+    return pdfextract.extract_page_range(file_path, start, end)
+
+
+def failing_range(file_path, start, end):
+    if start >= 2:
+        raise ValueError(f"broken page {start}")
+    return pdfextract.extract_page_range(file_path, start, end)
+
+
+@pytest.fixture
+def pdf_pool(mocker):
+    settings = get_settings().model_copy(
+        update={"PDF_EXTRACT_WORKERS": 2, "PDF_EXTRACT_PAGES_PER_TASK": 2}
+    )
+    mocker.patch.object(pdfextract, "get_settings", return_value=settings)
+    pdfextract.shutdown_pdf_pool()
+    yield
+    pdfextract.shutdown_pdf_pool()
+
+
+async def _pages(file_path):
+    return [page async for page in pdfextract.iter_pages(str(file_path))]
+
+
+@pytest.mark.anyio
+async def test_pages_come_back_in_document_order(tmp_path, pdf_pool, mocker):
+    file_path = tmp_path / "a.pdf"
+    write_pdf(file_path, [f"page {i}" for i in range(7)])
+    mocker.patch.object(pdfextract, "extract_page_range", slow_first_ranges)
+
+    pages = await asyncio.wait_for(_pages(file_path), 60)
+
+    assert [page.metadata["page"] for page in pages] == list(range(7))
+    assert [page.page_content.strip() for page in pages] == [
+        f"page {i}" for i in range(7)
+    ]
+    assert pages[0].metadata["source"] == str(file_path)
+
+
+@pytest.mark.anyio
+async def test_extraction_failure_is_raised_to_the_consumer(
+    tmp_path, pdf_pool, mocker
+):
+    file_path = tmp_path / "a.pdf"
+    write_pdf(file_path, [f"page {i}" for i in range(5)])
+    mocker.patch.object(pdfextract, "extract_page_range", failing_range)
+    seen = []
+
+    with pytest.raises(ValueError, match="broken page 2"):
+        async with asyncio.timeout(60):
+            async for page in pdfextract.iter_pages(str(file_path)):
+                seen.append(page.metadata["page"])
+
+    assert seen == [0, 1]
+
+
+@pytest.mark.anyio
+async def test_unreadable_file_is_raised_to_the_consumer(tmp_path, pdf_pool):
+    file_path = tmp_path / "a.pdf"
+    file_path.write_bytes(b"not a pdf")
+
+    with pytest.raises(PdfReadError):
+        await asyncio.wait_for(_pages(file_path), 60)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import vendor.redis as redis_helpers  # noqa: E402
+from services import quota  # noqa: E402
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    conn = fakeredis.FakeAsyncRedis()
+
+    async def incr_below_limit(*args, **kwargs):
+        return await redis_helpers.incr_below_limit(*args, **kwargs, conn=conn)
+
+    async def incr_expire_at(*args, **kwargs):
+        return await redis_helpers.incr_expire_at(*args, **kwargs, conn=conn)
+
+    mocker.patch.object(quota, "incr_below_limit", incr_below_limit)
+    mocker.patch.object(quota, "incr_expire_at", incr_expire_at)
+    mocker.patch.object(quota, "get_userlimit", return_value=None)
+    mocker.patch.object(quota, "quota_flusher")
+    return conn
+
+
+async def _chat_cnt(conn, use_date):
+    value = await conn.get(quota._quota_key("aa", use_date))
+    return None if value is None else int(value)
+
+
+@pytest.mark.anyio
+async def test_acquire_stops_at_the_limit(fake_redis, mocker):
+    mocker.patch.object(quota, "get_current_date_str", return_value="2099-01-01")
+
+    taken = [await quota.acquire_chat_quota("aa", 2) for _ in range(3)]
+
+    assert taken == ["2099-01-01", "2099-01-01", None]
+    assert await _chat_cnt(fake_redis, "2099-01-01") == 2
+
+
+@pytest.mark.anyio
+async def test_release_after_midnight_returns_the_chat_to_its_day(fake_redis, mocker):
+    today = mocker.patch.object(quota, "get_current_date_str", return_value="2099-01-01")
+    quota_date = await quota.acquire_chat_quota("aa", 2)
+    today.return_value = "2099-01-02"
+    await quota.acquire_chat_quota("aa", 2)
+
+    await quota.release_chat_quota("aa", quota_date)
+
+    assert await _chat_cnt(fake_redis, "2099-01-01") == 0
+    assert await _chat_cnt(fake_redis, "2099-01-02") == 1
+
+
+@pytest.mark.anyio
+async def test_stop_during_a_flush_keeps_its_counters(mocker):
+    mocker.patch.object(quota, "amget", return_value=[None])
+    flushing = asyncio.Event()
+    written = []
+
+    async def bulk_set_userlimits(dirty):
+        flushing.set()
+        await asyncio.sleep(0.05)
+        written.append(dict(dirty))
+
+    mocker.patch.object(quota, "bulk_set_userlimits", bulk_set_userlimits)
+    flusher = quota.QuotaFlusher(interval=0.01)
+    flusher.mark("aa", "2099-01-01", 3)
+    flusher.start()
+    await flushing.wait()
+
+    await flusher.stop()
+
+    assert written == [{("aa", "2099-01-01"): 3}]
@@ -0,0 +1,57 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import vendor.redis as redis_helpers  # noqa: E402
+
+KEY = "user:message-limit:per-30s:aa"
+
+
+@pytest.fixture
+def conn():
+    return fakeredis.FakeAsyncRedis()
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [1706275357.0]
+    mocker.patch.object(redis_helpers.time, "time", lambda: now[0])
+    return now
+
+
+async def _pass(conn, time_period=30, limit_count=3):
+    return await redis_helpers.can_pass_slide_window(
+        KEY, time_period, limit_count, conn=conn
+    )
+
+
+@pytest.mark.anyio
+async def test_limit_within_the_window(conn, clock):
+    # same millisecond requests are counted separately
+    assert [await _pass(conn) for _ in range(4)] == [True, True, True, False]
+    assert await conn.zcard(KEY) == 3
+
+
+@pytest.mark.anyio
+async def test_window_edges(conn, clock):
+    start = clock[0]
+    for _ in range(3):
+        assert await _pass(conn)
+    clock[0] = start + 29.999
+    assert not await _pass(conn)
+    # requests exactly time_period old have left the window
+    clock[0] = start + 30
+    assert await _pass(conn)
+    assert await conn.zcard(KEY) == 1
+
+
+@pytest.mark.anyio
+async def test_zero_limit_lets_the_first_request_through(conn, clock):
+    assert await _pass(conn, limit_count=0)
+    assert not await _pass(conn, limit_count=0)
+
+
+@pytest.mark.anyio
+async def test_key_expires_after_the_window(conn, clock):
+    await _pass(conn, time_period=30)
+    assert 30 < await conn.ttl(KEY) <= 40
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from services.responsecache import ResponseCache
+
+
+@pytest.mark.anyio
+async def test_identical_requests_share_one_upstream_call(mocker):
+    mocker.patch("services.responsecache.aget", return_value=None)
+    aset = mocker.patch("services.responsecache.aset")
+    cache = ResponseCache()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "hello"
+
+    payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}]}
+    answers = await asyncio.gather(
+        *[cache.get_or_call(payload, call, 60) for _ in range(10)]
+    )
+
+    assert answers == ["hello"] * 10
+    assert calls == 1
+    aset.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_cached_answer_skips_upstream(mocker):
+    mocker.patch("services.responsecache.aget", return_value="cached")
+    cache = ResponseCache()
+
+    async def call():
+        raise AssertionError("upstream must not be called")
+
+    assert await cache.get_or_call({"model": "m"}, call, 60) == "cached"
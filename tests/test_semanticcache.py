@@ -0,0 +1,30 @@
+import time
+
+from services.semanticcache import SemanticCache
+
+
+def test_similar_question_hits_same_document_only():
+    cache = SemanticCache(max_entries=10, ttl=60, threshold=0.95)
+    cache.put("doc-a", "what is the refund policy?", [1.0, 0.0, 0.1], "30 days")
+
+    assert cache.get("doc-a", [0.99, 0.01, 0.1]) == "30 days"
+    assert cache.get("doc-a", [0.0, 1.0, 0.0]) is None
+    assert cache.get("doc-b", [1.0, 0.0, 0.1]) is None
+
+
+def test_ttl_lru_and_invalidate():
+    cache = SemanticCache(max_entries=2, ttl=60, threshold=0.95)
+    cache.put("doc-a", "q1", [1.0, 0.0], "a1")
+    cache.put("doc-a", "q2", [0.0, 1.0], "a2")
+    # q1 was used last, q2 is evicted
+    assert cache.get("doc-a", [1.0, 0.0]) == "a1"
+    cache.put("doc-b", "q3", [1.0, 1.0], "a3")
+    assert cache.get("doc-a", [0.0, 1.0]) is None
+
+    cache.invalidate("doc-a")
+    assert cache.get("doc-a", [1.0, 0.0]) is None
+
+    cache.ttl = 0
+    cache.put("doc-c", "q4", [1.0, 0.0], "a4")
+    time.sleep(0.01)
+    assert cache.get("doc-c", [1.0, 0.0]) is None
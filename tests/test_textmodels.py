@@ -0,0 +1,115 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("transformers")
+
+from services.textmodels import ModelRegistry  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class FakeParam:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeModel:
+    def __init__(self, name: str, nbytes: int = MB):
+        self.name = name
+        self._params = [FakeParam(nbytes)]
+
+    def parameters(self):
+        return self._params
+
+
+class FakeLoader:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.loaded = []
+        self._lock = threading.Lock()
+
+    def __call__(self, name: str) -> FakeModel:
+        time.sleep(self.delay)
+        with self._lock:
+            self.loaded.append(name)
+        return FakeModel(name)
+
+
+def _cached(registry):
+    return [name for _, name in registry._entries]
+
+
+def test_memory_budget_evicts_least_recently_used():
+    registry = ModelRegistry(max_entries=0, max_memory_mb=2)
+    loader = FakeLoader()
+    registry._get_or_load("summarizer", "a", loader)
+    registry._get_or_load("summarizer", "b", loader)
+    # a is used again, b becomes the least recently used
+    registry._get_or_load("summarizer", "a", loader)
+    registry._get_or_load("summarizer", "c", loader)
+
+    assert _cached(registry) == ["a", "c"]
+    assert registry.memory_bytes() == 2 * MB
+    assert loader.loaded == ["a", "b", "c"]
+
+
+def test_max_entries_evicts_in_lru_order():
+    registry = ModelRegistry(max_entries=2)
+    loader = FakeLoader()
+    for name in ["a", "b", "c", "d"]:
+        registry._get_or_load("tokenizer", name, loader)
+
+    assert _cached(registry) == ["c", "d"]
+
+
+def test_a_model_over_budget_is_still_kept():
+    registry = ModelRegistry(max_entries=0, max_memory_mb=1)
+
+    model = registry._get_or_load(
+        "summarizer", "big", lambda name: FakeModel(name, 3 * MB)
+    )
+
+    assert _cached(registry) == ["big"]
+    assert registry._get_or_load("summarizer", "big", FakeLoader()) is model
+
+
+def test_concurrent_gets_load_a_key_once():
+    registry = ModelRegistry()
+    loader = FakeLoader(delay=0.05)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        models = list(
+            executor.map(
+                lambda _: registry._get_or_load("summarizer", "a", loader), range(8)
+            )
+        )
+
+    assert loader.loaded == ["a"]
+    assert all(model is models[0] for model in models)
+
+
+def test_loading_one_key_does_not_block_another():
+    registry = ModelRegistry()
+    release = threading.Event()
+
+    def slow_loader(name):
+        release.wait(5)
+        return FakeModel(name)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        slow = executor.submit(registry._get_or_load, "summarizer", "slow", slow_loader)
+        time.sleep(0.02)
+        fast = registry._get_or_load("tokenizer", "fast", FakeLoader())
+        assert fast.name == "fast"
+        assert not slow.done()
+        release.set()
+        assert slow.result().name == "slow"
@@ -0,0 +1,25 @@
+from services.topics import fit_topic_model, load_state, top_topic_terms
+
+
+TEXTS = [
+    "my friend asked me to help with the club member list",
+    "the club member meeting is on friday, my friend will help",
+    "can you help me write a message to a new club member",
+]
+
+
+def test_fit_topic_model_is_incremental():
+    state = fit_topic_model(None, TEXTS[:2], 2, n_features=256, n_topics=2)
+    assert load_state(state)["lda"].n_batch_iter_ == 2
+
+    state = fit_topic_model(state, TEXTS[2:], 3, n_features=256, n_topics=2)
+    model = load_state(state)
+    assert model["lda"].n_batch_iter_ == 3
+    assert "member" in model["terms"].values()
+
+
+def test_top_topic_terms_are_known_words():
+    state = fit_topic_model(None, TEXTS, 3, n_features=256, n_topics=2)
+    terms = top_topic_terms(state, 3)
+    assert len(terms) == 3
+    assert set(terms) <= set(" ".join(TEXTS).replace(",", "").split())
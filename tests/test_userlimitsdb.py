@@ -0,0 +1,38 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from config.config import merge_duplicates_before_unique_indexes
+
+
+def _row(user_name, use_date, chat_cnt, ctime):
+    return {
+        "user_name": user_name,
+        "use_date": use_date,
+        "chat_cnt": chat_cnt,
+        "ctime": ctime,
+        "mtime": ctime,
+    }
+
+
+@pytest.mark.anyio
+async def test_duplicate_userlimits_are_merged_before_the_unique_index():
+    database = AsyncMongoMockClient()["chatbot"]
+    collection = database["userlimits"]
+    await collection.insert_many(
+        [
+            _row("aa", "2024-01-29", 1, 1),
+            _row("aa", "2024-01-29", 2, 2),
+            _row("aa", "2024-01-30", 3, 3),
+            _row("bb", "2024-01-29", 4, 4),
+            _row("aa", "2024-01-29", 1, 5),
+        ]
+    )
+
+    await merge_duplicates_before_unique_indexes(database)
+
+    rows = await collection.find({}, {"_id": 0}).sort("ctime", 1).to_list(None)
+    assert rows == [
+        {**_row("aa", "2024-01-29", 4, 1), "mtime": 5},
+        _row("aa", "2024-01-30", 3, 3),
+        _row("bb", "2024-01-29", 4, 4),
+    ]